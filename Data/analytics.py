@@ -0,0 +1,203 @@
+import math
+from bisect import bisect_right
+from datatypes import BookFeatures
+
+
+class SpreadStats:
+    """
+    Running spread statistics (bps): count, mean / std (Welford), min, max and an EWMA
+    """
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max', 'ewma', 'alpha')
+
+    def __init__(self, alpha=0.05):
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.ewma = None
+
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.ewma = value if self.ewma is None else self.ewma + self.alpha * (value - self.ewma)
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+class BookAnalytics:
+    """
+    Book features for one exchange|symbol, refreshed after every applied update:
+    microprice, top `levels` size imbalance, cumulative depth within `depth_bps` of mid, average fill price
+    of a `fill_notional` (quote) market order per side and running spread statistics.
+    Works on the book's fixed-point sorted sides and only touches the levels a feature needs (top N, the
+    levels a fill would consume). Band depths are running sums: the book reports every diff before applying it
+    (OrderBook.listener), diffs inside the band adjust the sums and a moving mid only adds / removes the levels
+    crossing the band edges. Sums are recomputed after snapshots, every `full_refresh` updates and while the
+    band reaches the book's max_depth edge.
+    """
+
+    def __init__(self, orderbook, levels=5, depth_bps=10.0, fill_notional=10000.0, spread_alpha=0.05,
+                 full_refresh=1000):
+        self.orderbook = orderbook
+        self.levels = levels
+        self.depth_bps = depth_bps
+        self.fill_notional = fill_notional
+        self.full_refresh = full_refresh
+        self.spread = SpreadStats(spread_alpha)
+        self.features = None
+        self.updates = 0
+        self._dirty = True
+        self._bid_limit = self._ask_limit = None
+        self._bid_depth = self._ask_depth = 0
+        orderbook.listener = self
+
+    def on_snapshot(self):
+        self._dirty = True
+
+    def on_diffs(self, bids, asks):
+        if self._dirty:
+            return
+        bid_side = self.orderbook.bid_side
+        ask_side = self.orderbook.ask_side
+        # a band reaching the max_depth edge loses levels to truncation the diffs do not show: recompute
+        if bisect_right(bid_side.keys, -self._bid_limit) + len(bids) >= bid_side.max_depth \
+                or bisect_right(ask_side.keys, self._ask_limit) + len(asks) >= ask_side.max_depth:
+            self._dirty = True
+            return
+        # a price repeated within one message replaces its earlier quantity, not the resting one
+        levels = bid_side.levels
+        limit = self._bid_limit
+        applied = {}
+        for price, quantity in bids:
+            if price >= limit:
+                self._bid_depth += quantity - applied.get(price, levels.get(price, 0))
+                applied[price] = quantity
+        levels = ask_side.levels
+        limit = self._ask_limit
+        applied = {}
+        for price, quantity in asks:
+            if price <= limit:
+                self._ask_depth += quantity - applied.get(price, levels.get(price, 0))
+                applied[price] = quantity
+
+    @staticmethod
+    def _shift_band(side, old_limit, new_limit, depth):
+        # band sum for new_limit from the sum for old_limit, touching only the levels in between
+        sign = side.sign
+        keys = side.keys
+        levels = side.levels
+        old_end = bisect_right(keys, sign * old_limit)
+        new_end = bisect_right(keys, sign * new_limit)
+        if new_end > old_end:
+            depth += sum(levels[sign * k] for k in keys[old_end:new_end])
+        elif new_end < old_end:
+            depth -= sum(levels[sign * k] for k in keys[new_end:old_end])
+        return depth
+
+    def _band_depth(self, side, price_limit):
+        # levels priced at or inside price_limit (bids >= limit, asks <= limit)
+        sign = side.sign
+        keys = side.keys
+        end = bisect_right(keys, sign * price_limit)
+        levels = side.levels
+        return sum(levels[sign * k] for k in keys[:end])
+
+    def _fill_price(self, side, quote_target):
+        # average price (ticks) of a market order consuming quote_target quote units, None if the side is too thin
+        sign = side.sign
+        levels = side.levels
+        remaining = quote_target
+        cost = 0
+        filled = 0
+        for key in side.keys:
+            price = sign * key
+            quantity = levels[price]
+            level_quote = price * quantity
+            if level_quote >= remaining:
+                take = remaining // price
+                if take == 0 and filled == 0:
+                    return price
+                cost += take * price
+                filled += take
+                remaining = 0
+                break
+            cost += level_quote
+            filled += quantity
+            remaining -= level_quote
+        if remaining > 0 or filled == 0:
+            return None
+        return cost / filled
+
+    def update(self, event_time=None):
+        """
+        Recomputes the features, returns a BookFeatures (None while a side is empty)
+        """
+        book = self.orderbook
+        bid_side = book.bid_side
+        ask_side = book.ask_side
+        if not bid_side.keys or not ask_side.keys:
+            self.features = None
+            return None
+
+        scale = book.scale
+        price_factor = scale.price_factor
+        qty_factor = scale.qty_factor
+        bid_price, bid_qty = bid_side.best()
+        ask_price, ask_qty = ask_side.best()
+
+        mid = (bid_price + ask_price) / 2
+        spread = ask_price - bid_price
+        spread_bps = spread / mid * 1e4
+        microprice = (bid_price * ask_qty + ask_price * bid_qty) / (bid_qty + ask_qty)
+
+        bid_levels = bid_side.levels
+        ask_levels = ask_side.levels
+        n = self.levels
+        bid_top = sum(bid_levels[-k] for k in bid_side.keys[:n])
+        ask_top = sum(ask_levels[k] for k in ask_side.keys[:n])
+        imbalance = (bid_top - ask_top) / (bid_top + ask_top)
+
+        band = mid * self.depth_bps / 1e4
+        bid_limit = math.ceil(mid - band)
+        ask_limit = math.floor(mid + band)
+        if self._dirty or self.updates % self.full_refresh == 0:
+            self._bid_depth = self._band_depth(bid_side, bid_limit)
+            self._ask_depth = self._band_depth(ask_side, ask_limit)
+            self._dirty = False
+        else:
+            self._bid_depth = self._shift_band(bid_side, self._bid_limit, bid_limit, self._bid_depth)
+            self._ask_depth = self._shift_band(ask_side, self._ask_limit, ask_limit, self._ask_depth)
+        self._bid_limit = bid_limit
+        self._ask_limit = ask_limit
+        bid_depth = self._bid_depth
+        ask_depth = self._ask_depth
+
+        buy_fill = sell_fill = None
+        if self.fill_notional:
+            quote_target = int(self.fill_notional * scale.quote_factor)
+            buy_fill = self._fill_price(ask_side, quote_target)
+            sell_fill = self._fill_price(bid_side, quote_target)
+
+        self.spread.update(spread_bps)
+        self.updates += 1
+        self.features = BookFeatures(book.exchange, book.symbol,
+                                     event_time if event_time is not None else book.timestamp,
+                                     mid / price_factor, spread / price_factor, spread_bps,
+                                     microprice / price_factor, imbalance,
+                                     bid_depth / qty_factor, ask_depth / qty_factor,
+                                     buy_fill / price_factor if buy_fill is not None else None,
+                                     sell_fill / price_factor if sell_fill is not None else None)
+        return self.features
@@ -0,0 +1,74 @@
+from types import MappingProxyType
+from typing import Dict
+from datatypes import Balance
+
+
+class Balances:
+    """
+    Asset-keyed balances of one exchange account. Updates are O(1) per asset and report only the assets whose
+    free / locked amounts actually changed; view() is a read-only live mapping, snapshot() a point-in-time copy.
+    """
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.assets: Dict[str, Balance] = {}
+        self.event_time = None
+        self._view = MappingProxyType(self.assets)
+
+    def __len__(self):
+        return len(self.assets)
+
+    def __contains__(self, asset):
+        return asset in self.assets
+
+    def __getitem__(self, asset):
+        return self.assets[asset]
+
+    def __iter__(self):
+        return iter(self.assets.values())
+
+    def get(self, asset, default=None):
+        return self.assets.get(asset, default)
+
+    def _set(self, asset, free, locked, changed):
+        balance = Balance(asset, free, locked)
+        if self.assets.get(asset) != balance:
+            self.assets[asset] = balance
+            changed.append(balance)
+
+    def apply_snapshot(self, event_time, rows):
+        """
+        Replaces all balances from [asset, free, locked] rows, assets missing from the snapshot drop to zero
+        """
+        changed = []
+        seen = set()
+        for asset, free, locked in rows:
+            seen.add(asset)
+            self._set(asset, float(free), float(locked), changed)
+        for asset in [asset for asset in self.assets if asset not in seen]:
+            del self.assets[asset]
+            changed.append(Balance(asset, 0.0, 0.0))
+        self.event_time = event_time
+        return changed
+
+    def apply_update(self, event_time, updates):
+        """
+        Applies outboundAccountPosition-style {'a': asset, 'f': free, 'l': locked} rows
+        """
+        changed = []
+        for x in updates:
+            self._set(x.get('a'), float(x.get('f')), float(x.get('l')), changed)
+        self.event_time = event_time
+        return changed
+
+    def view(self):
+        return self._view
+
+    def snapshot(self):
+        return dict(self.assets)
+
+    def rows(self):
+        """
+        [asset, free, locked] rows, the layout of balance snapshot messages
+        """
+        return [[b.asset, b.free, b.locked] for b in self.assets.values()]
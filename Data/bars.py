@@ -0,0 +1,160 @@
+import time
+from ringbuffer import RingBuffer
+from datatypes import Bar
+
+BAR_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'buy_volume', 'trades', 'vwap', 'quotes']
+
+
+def resolution_label(resolution):
+    """
+    Storage / display name of a bar resolution in seconds: 0.1 -> '100ms', 1 -> '1s', 60 -> '1m'
+    """
+    if resolution < 1:
+        return f'{round(resolution * 1000)}ms'
+    if resolution < 60 or resolution % 60:
+        return f'{resolution:g}s'
+    if resolution < 3600 or resolution % 3600:
+        return f'{resolution // 60:g}m'
+    return f'{resolution // 3600:g}h'
+
+
+class BarBuilder:
+    """
+    Time bars of one resolution: mid OHLC from quotes, volume / taker buy volume / count / VWAP from trades.
+    Only the open bar is kept as scalars, completed bars go to a fixed-size ring buffer. A bar starts at the
+    previous bar's close mid, events are bucketed by exchange time in ms; late events (behind the open or an
+    already closed bar) are folded into the open bar.
+    """
+    __slots__ = ('resolution', 'span', 'bucket', 'last_closed', 'open', 'high', 'low', 'close', 'volume',
+                 'buy_volume', 'notional', 'trades', 'quotes', 'history')
+
+    def __init__(self, resolution, history=10000):
+        self.resolution = resolution
+        self.span = int(round(resolution * 1000))
+        self.bucket = None
+        self.last_closed = -1
+        self.close = None
+        self.history = RingBuffer(history, BAR_COLUMNS)
+        self._reset()
+
+    def _reset(self):
+        self.open = self.high = self.low = self.close
+        self.volume = 0.0
+        self.buy_volume = 0.0
+        self.notional = 0.0
+        self.trades = 0
+        self.quotes = 0
+
+    def _roll(self, time_ms):
+        # moves to the bucket of time_ms, returns the bar it completed
+        bucket = max(time_ms // self.span, self.last_closed + 1)
+        if self.bucket is None:
+            self.bucket = bucket
+            return None
+        if bucket <= self.bucket:
+            return None
+        bar = self._close()
+        self.bucket = bucket
+        return bar
+
+    def _close(self):
+        vwap = self.notional / self.volume if self.volume else None
+        start = self.bucket * self.span / 1000
+        self.history.append(start, self.open if self.open is not None else float('nan'),
+                            self.high if self.high is not None else float('nan'),
+                            self.low if self.low is not None else float('nan'),
+                            self.close if self.close is not None else float('nan'),
+                            self.volume, self.buy_volume, self.trades, vwap if vwap is not None else float('nan'),
+                            self.quotes)
+        bar = (start, self.open, self.high, self.low, self.close, self.volume, self.buy_volume, self.trades, vwap,
+               self.quotes)
+        self.last_closed = self.bucket
+        self.bucket = None
+        self._reset()
+        return bar
+
+    def on_quote(self, time_ms, mid):
+        bar = self._roll(time_ms)
+        if self.open is None:
+            self.open = self.high = self.low = mid
+        elif mid > self.high:
+            self.high = mid
+        elif mid < self.low:
+            self.low = mid
+        self.close = mid
+        self.quotes += 1
+        return bar
+
+    def on_trade(self, time_ms, price, quantity, is_buy):
+        bar = self._roll(time_ms)
+        self.volume += quantity
+        self.notional += price * quantity
+        if is_buy:
+            self.buy_volume += quantity
+        self.trades += 1
+        return bar
+
+    def flush(self, now_ms):
+        """
+        Completes the open bar once its interval has ended at now_ms
+        """
+        if self.bucket is not None and (self.bucket + 1) * self.span <= now_ms:
+            return self._close()
+        return None
+
+
+class BarResampler:
+    """
+    Bars at several resolutions (seconds) for one exchange|symbol, all updated per event in O(resolutions)
+    with fixed memory. Methods return the Bars completed by the event, usually none.
+    Bars are bucketed by exchange time, so quiet books are flushed against the exchange clock as well:
+    exchange_time() is the latest event time plus the local (monotonic) time elapsed since it arrived.
+    """
+
+    def __init__(self, exchange, symbol, resolutions=(0.1, 1, 60), history=10000):
+        self.exchange = exchange
+        self.symbol = symbol.upper()
+        self.builders = {resolution: BarBuilder(resolution, history) for resolution in sorted(resolutions)}
+        self.last_event_time = None
+        self._last_event_local = None
+
+    def _bars(self, completed):
+        return [Bar(self.exchange, self.symbol, resolution, *bar) for resolution, bar in completed if bar is not None]
+
+    def _seen(self, event_time):
+        if self.last_event_time is None or event_time >= self.last_event_time:
+            self.last_event_time = event_time
+            self._last_event_local = time.monotonic()
+
+    def exchange_time(self):
+        """
+        Estimated current exchange time (seconds), None before the first event
+        """
+        if self.last_event_time is None:
+            return None
+        return self.last_event_time + time.monotonic() - self._last_event_local
+
+    def on_quote(self, event_time, mid):
+        self._seen(event_time)
+        time_ms = int(event_time * 1000)
+        return self._bars([(resolution, builder.on_quote(time_ms, mid))
+                           for resolution, builder in self.builders.items()])
+
+    def on_trade(self, event_time, price, quantity, is_buy):
+        self._seen(event_time)
+        time_ms = int(event_time * 1000)
+        return self._bars([(resolution, builder.on_trade(time_ms, price, quantity, is_buy))
+                           for resolution, builder in self.builders.items()])
+
+    def flush(self, now):
+        """
+        Completes the bars whose interval ended at now (exchange clock, seconds)
+        """
+        now_ms = int(now * 1000)
+        return self._bars([(resolution, builder.flush(now_ms)) for resolution, builder in self.builders.items()])
+
+    def history(self, resolution):
+        """
+        RingBuffer of completed bars (BAR_COLUMNS) at resolution
+        """
+        return self.builders[resolution].history
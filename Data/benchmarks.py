@@ -0,0 +1,454 @@
+"""
+Throughput / latency benchmarks for the market data pipeline
+
+    python benchmarks.py decode --n 50000
+    python benchmarks.py book --depth 1000 --updates 20000 --symbols 3 --impl orderbook --impl legacy
+    python benchmarks.py book --save book.json
+    python benchmarks.py book --check book.json --tolerance 0.1
+    python benchmarks.py balances --assets 50 --updates 20000
+"""
+import argparse
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+from data_handling import orderbook_update_handler, apply_balance_updates
+from datatypes import BookMessage, SnapshotMessage, DepthUpdate, BalanceMessage
+from decoding import available_backends, get_decoder
+from exchanges import binance_us
+from fixedpoint import SymbolScale
+from orderbook import OrderBook
+from booksync import BookSync
+from balances import Balances
+from analytics import BookAnalytics
+
+
+def binance_frames(symbol='BTCUSD', n=1000, levels=20, seed=0):
+    """
+    Synthetic Binance depthUpdate / trade / executionReport websocket frames as JSON strings
+    """
+    rng = random.Random(seed)
+    frames = {'depth': [], 'trade': [], 'execution': []}
+    update_id = 1000
+    mid = 30000.0
+    for i in range(n):
+        mid += rng.gauss(0, 1)
+        bids = [[f'{mid - 0.01 * (k + 1):.8f}', f'{rng.random() * (k > 2):.8f}'] for k in range(levels)]
+        asks = [[f'{mid + 0.01 * (k + 1):.8f}', f'{rng.random() * (k > 2):.8f}'] for k in range(levels)]
+        frames['depth'].append(json.dumps({'e': 'depthUpdate', 'E': 1672515782136 + i, 's': symbol,
+                                           'U': update_id + 1, 'u': update_id + 2 * levels,
+                                           'b': bids, 'a': asks}))
+        update_id += 2 * levels
+        frames['trade'].append(json.dumps({'e': 'trade', 'E': 1672515782136 + i, 's': symbol, 't': 12345 + i,
+                                           'p': f'{mid:.8f}', 'q': f'{rng.random():.8f}', 'b': 88, 'a': 50,
+                                           'T': 1672515782136 + i, 'm': rng.random() > 0.5, 'M': True}))
+        frames['execution'].append(json.dumps({'e': 'executionReport', 'E': 1672515782136 + i, 's': symbol,
+                                               'c': f'order{i}', 'S': 'BUY', 'o': 'LIMIT', 'f': 'GTC',
+                                               'q': '1.00000000', 'p': f'{mid:.8f}', 'P': '0.00000000',
+                                               'F': '0.00000000', 'g': -1, 'C': '', 'x': 'TRADE',
+                                               'X': 'FILLED', 'r': 'NONE', 'i': 4293153 + i,
+                                               'l': '1.00000000', 'z': '1.00000000', 'L': f'{mid:.8f}',
+                                               'n': '0', 'N': None, 'T': 1672515782136 + i, 't': -1,
+                                               'I': 8641984, 'w': False, 'm': True, 'M': False,
+                                               'O': 1672515782136 + i, 'Z': f'{mid:.8f}',
+                                               'Y': f'{mid:.8f}', 'Q': '0.00000000'}))
+    return frames
+
+
+def run_timed(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return time.perf_counter() - start
+
+
+def bench_decode(n=50000, levels=20, backends=None):
+    """
+    Decode + normalize throughput into typed messages, per JSON backend and message kind
+    """
+    exchange = binance_us(symbols=['BTCUSD'])
+    builders = {'depth': exchange.modify_update_msg,
+                'trade': exchange.modify_trade_msg,
+                'execution': exchange.order_update_msg}
+    frames = binance_frames(n=n, levels=levels)
+
+    print(f'{"backend":<10}{"message":<12}{"msgs/sec":>14}{"us/msg":>10}')
+    for backend in backends or available_backends():
+        _, loads = get_decoder(backend)
+        for kind, build in builders.items():
+            elapsed = run_timed(lambda frame: build(loads(frame)), frames[kind])
+            print(f'{backend:<10}{kind:<12}{n / elapsed:>14,.0f}{elapsed / n * 1e6:>10.2f}')
+
+
+# synthetic order book streams
+
+def synthetic_depth_stream(symbol='BTCUSD', depth=1000, n_updates=10000, update_size=20, volatility=0.5,
+                           tick=0.01, seed=0):
+    """
+    Binance-style REST depth snapshot and @depth diff stream (string levels) around a random-walk mid.
+    volatility is the standard deviation of the mid move per update, in ticks; about 30% of diff levels
+    are deletions (quantity 0).
+    """
+    rng = random.Random(seed)
+    mid = 30000.0 / tick
+    last_update_id = 1000
+    bids = [[f'{(mid - k) * tick:.8f}', f'{rng.uniform(0.001, 5):.8f}'] for k in range(1, depth + 1)]
+    asks = [[f'{(mid + k) * tick:.8f}', f'{rng.uniform(0.001, 5):.8f}'] for k in range(1, depth + 1)]
+    snapshot = {'lastUpdateId': last_update_id, 'bids': bids, 'asks': asks}
+
+    diffs = []
+    for i in range(n_updates):
+        mid = round(mid + rng.gauss(0, volatility))
+        diff_bids = []
+        diff_asks = []
+        for _ in range(update_size):
+            distance = int(rng.expovariate(1 / max(depth / 10, 1))) + 1
+            quantity = 0.0 if rng.random() < 0.3 else rng.uniform(0.001, 5)
+            if rng.random() < 0.5:
+                diff_bids.append([f'{(mid - distance) * tick:.8f}', f'{quantity:.8f}'])
+            else:
+                diff_asks.append([f'{(mid + distance) * tick:.8f}', f'{quantity:.8f}'])
+        diffs.append({'e': 'depthUpdate', 'E': 1672515782136 + 100 * i, 's': symbol,
+                      'U': last_update_id + 1, 'u': last_update_id + update_size,
+                      'b': diff_bids, 'a': diff_asks})
+        last_update_id += update_size
+    return snapshot, diffs
+
+
+def book_workload(symbols=1, depth=1000, n_updates=10000, update_size=20, volatility=0.5, seed=0):
+    """
+    {symbol: (snapshot, diffs)} plus the round-robin interleaved order in which diffs arrive
+    """
+    streams = {}
+    for k in range(symbols):
+        symbol = f'SYM{k}USD'
+        streams[symbol] = synthetic_depth_stream(symbol, depth, n_updates // symbols, update_size, volatility,
+                                                 seed=seed + k)
+    order = [(symbol, i) for i in range(n_updates // symbols) for symbol in streams]
+    return streams, order
+
+
+# book implementations: setup(streams) -> (state, messages by symbol), apply(state, symbol, msg)
+
+class _BenchExchange:
+    name = 'Bench'
+    snapshot_in_ws = False
+    symbols_active = {}
+
+
+def legacy_apply_diffs(ob, update_msg):
+    """
+    Reference copy of the original list-scanning apply_diffs, for side-by-side comparison
+    """
+    order_book = {
+        'messageType': 'live_orderbook',
+        'message': {'lastUpdateId': update_msg['message']['lastUpdateId'],
+                    'bids': ob['message']['bids'],
+                    'asks': ob['message']['asks']
+                    },
+        'timestamp': time.time(),
+        'symbol': ob['symbol'].upper(),
+        'exchange': ob['exchange']
+    }
+    for side in ['bids', 'asks']:
+        for update in update_msg['message'][side]:
+            price, quantity = update
+            found = False
+            for i in range(0, len(order_book['message'][side])):
+                if price == order_book['message'][side][i][0]:
+                    if float(quantity) == 0:
+                        order_book['message'][side].pop(i)
+                    else:
+                        order_book['message'][side][i] = update
+                    found = True
+                    break
+            if not found and float(quantity) != 0:
+                order_book['message'][side].append(update)
+                if side == 'asks':
+                    order_book['message'][side] = sorted(order_book['message'][side])
+                else:
+                    order_book['message'][side] = sorted(order_book['message'][side], reverse=True)
+                if len(order_book['message'][side]) > 1000:
+                    order_book['message'][side].pop(len(order_book['message'][side]) - 1)
+    return order_book
+
+
+def _setup_orderbook(streams):
+    books = {}
+    messages = {}
+    for symbol, (snapshot, diffs) in streams.items():
+        scale = SymbolScale(symbol, 2, 8)
+        book = OrderBook('Bench', symbol, scale=scale)
+        books[symbol] = BookSync(_BenchExchange, symbol, book, None)
+        books[symbol].on_snapshot(BookMessage('orderbook_snapshot',
+                                        SnapshotMessage(symbol, snapshot['lastUpdateId'],
+                                                        scale.decode_levels(snapshot['bids']),
+                                                        scale.decode_levels(snapshot['asks'])),
+                                        0.0, symbol, 'Bench'))
+        messages[symbol] = [BookMessage('orderbook_update',
+                                        DepthUpdate(symbol, d['E'], d['U'], d['u'],
+                                                    scale.decode_levels(d['b']), scale.decode_levels(d['a'])),
+                                        0.0, symbol, 'Bench') for d in diffs]
+    return books, messages
+
+
+def _apply_orderbook(books, symbol, msg):
+    orderbook_update_handler(books[symbol], msg)
+
+
+def _setup_analytics(streams):
+    books, messages = _setup_orderbook(streams)
+    return {symbol: (sync, BookAnalytics(sync.orderbook)) for symbol, sync in books.items()}, messages
+
+
+def _apply_analytics(books, symbol, msg):
+    sync, analytics = books[symbol]
+    if orderbook_update_handler(sync, msg):
+        analytics.update()
+
+
+def _setup_legacy(streams):
+    books = {}
+    messages = {}
+    for symbol, (snapshot, diffs) in streams.items():
+        books[symbol] = {'messageType': 'orderbook_snapshot',
+                         'message': {'lastUpdateId': snapshot['lastUpdateId'],
+                                     'bids': [list(level) for level in snapshot['bids']],
+                                     'asks': [list(level) for level in snapshot['asks']]},
+                         'symbol': symbol, 'exchange': 'Bench'}
+        messages[symbol] = [{'message': {'lastUpdateId': d['u'], 'bids': d['b'], 'asks': d['a']}} for d in diffs]
+    return books, messages
+
+
+def _apply_legacy(books, symbol, msg):
+    books[symbol] = legacy_apply_diffs(books[symbol], msg)
+
+
+BOOK_IMPLEMENTATIONS = {
+    'orderbook': (_setup_orderbook, _apply_orderbook),
+    'analytics': (_setup_analytics, _apply_analytics),
+    'legacy': (_setup_legacy, _apply_legacy),
+}
+
+
+def latency_summary(latencies_ns, elapsed):
+    latencies = sorted(latencies_ns)
+    n = len(latencies)
+
+    def pct(p):
+        return latencies[min(n - 1, int(p / 100 * n))] / 1000
+
+    return {'updates': n,
+            'updates_per_sec': n / elapsed if elapsed else 0.0,
+            'p50_us': pct(50), 'p90_us': pct(90), 'p99_us': pct(99), 'p999_us': pct(99.9),
+            'max_us': latencies[-1] / 1000}
+
+
+def _timed_run(apply, state, order, messages):
+    latencies = []
+    perf_counter_ns = time.perf_counter_ns
+    start = time.perf_counter()
+    for symbol, i in order:
+        t0 = perf_counter_ns()
+        apply(state, symbol, messages[symbol][i])
+        latencies.append(perf_counter_ns() - t0)
+    return latencies, time.perf_counter() - start
+
+
+def _traced_run(apply, state, order, messages):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for symbol, i in order:
+        apply(state, symbol, messages[symbol][i])
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    return peak, blocks
+
+
+def run_implementation(setup, apply, streams, order):
+    """
+    Timed pass (throughput, per-update latency) and a separate tracemalloc pass (peak memory, net blocks)
+    """
+    state, messages = setup(streams)
+    gc.collect()
+    latencies, elapsed = _timed_run(apply, state, order, messages)
+    result = latency_summary(latencies, elapsed)
+
+    state, messages = setup(streams)
+    peak, blocks = _traced_run(apply, state, order, messages)
+    result['peak_kib'] = peak / 1024
+    result['net_blocks_per_update'] = blocks / len(order)
+    return result
+
+
+def print_results(results):
+    print(f'{"impl":<12}{"updates/s":>12}{"p50 us":>9}{"p90 us":>9}{"p99 us":>9}{"p99.9 us":>10}'
+          f'{"max us":>10}{"peak KiB":>10}{"blocks/upd":>11}')
+    for name, r in results.items():
+        print(f'{name:<12}{r["updates_per_sec"]:>12,.0f}{r["p50_us"]:>9.1f}{r["p90_us"]:>9.1f}'
+              f'{r["p99_us"]:>9.1f}{r["p999_us"]:>10.1f}{r["max_us"]:>10.1f}{r["peak_kib"]:>10.0f}'
+              f'{r["net_blocks_per_update"]:>11.2f}')
+
+
+def check_regressions(results, baseline, tolerance):
+    """
+    Compares against saved results: throughput may not drop and p99 latency may not rise by more than tolerance
+    """
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if r['updates_per_sec'] < base['updates_per_sec'] * (1 - tolerance):
+            regressions.append(f'{name}: updates/s {r["updates_per_sec"]:,.0f} vs {base["updates_per_sec"]:,.0f}')
+        if r['p99_us'] > base['p99_us'] * (1 + tolerance):
+            regressions.append(f'{name}: p99 {r["p99_us"]:.1f}us vs {base["p99_us"]:.1f}us')
+    return regressions
+
+
+def bench_book(implementations=None, symbols=1, depth=1000, n_updates=20000, update_size=20, volatility=0.5,
+               seed=0):
+    streams, order = book_workload(symbols, depth, n_updates, update_size, volatility, seed)
+    results = {}
+    for name in implementations or ['orderbook']:
+        setup, apply = BOOK_IMPLEMENTATIONS[name]
+        results[name] = run_implementation(setup, apply, streams, order)
+    return results
+
+
+# balances
+
+def synthetic_balance_stream(n_assets=50, n_updates=10000, update_assets=3, seed=0):
+    """
+    Account snapshot message and outboundAccountPosition-style balance updates
+    """
+    rng = random.Random(seed)
+    assets = [f'A{k}' for k in range(n_assets - 1)] + ['USD']
+    snapshot = [[asset, rng.uniform(0, 100), 0.0] for asset in assets]
+    updates = []
+    for i in range(n_updates):
+        changed = rng.sample(assets, update_assets)
+        updates.append([{'a': asset, 'f': f'{rng.uniform(0, 100):.8f}', 'l': f'{rng.uniform(0, 1):.8f}'}
+                        for asset in changed])
+    return snapshot, updates
+
+
+def legacy_apply_balance_updates(snapshot, update_msg):
+    """
+    Reference copy of the original list-scanning apply_balance_updates
+    """
+    if update_msg.msgType == 'snapshot':
+        return update_msg
+
+    else:
+        update_bals = update_msg.balances
+        snapshot_bals = snapshot.balances
+        for x in update_bals:
+            b = [x.get('a'), float(x.get('f')), float(x.get('l'))]
+            for i, bal in enumerate(snapshot_bals):
+                if bal[0] == b[0]:
+                    snapshot_bals.pop(i)
+                    snapshot_bals.append(b)
+                else:
+                    continue
+        return BalanceMessage('update', update_msg.eventTime, snapshot_bals)
+
+
+def _balance_messages(updates):
+    return {'balances': [BalanceMessage('update', float(i), balances) for i, balances in enumerate(updates)]}
+
+
+def _setup_balances(workload):
+    snapshot, updates = workload
+    balances = Balances('Bench')
+    apply_balance_updates(balances, BalanceMessage('snapshot', 0.0, [list(b) for b in snapshot]))
+    return {'balances': balances}, _balance_messages(updates)
+
+
+def _apply_balances(state, key, msg):
+    apply_balance_updates(state[key], msg)
+
+
+def _setup_legacy_balances(workload):
+    snapshot, updates = workload
+    state = {'balances': legacy_apply_balance_updates(None, BalanceMessage('snapshot', 0.0,
+                                                                           [list(b) for b in snapshot]))}
+    return state, _balance_messages(updates)
+
+
+def _apply_legacy_balances(state, key, msg):
+    state[key] = legacy_apply_balance_updates(state[key], msg)
+
+
+BALANCE_IMPLEMENTATIONS = {
+    'balances': (_setup_balances, _apply_balances),
+    'legacy': (_setup_legacy_balances, _apply_legacy_balances),
+}
+
+
+def bench_balances(implementations=None, n_assets=50, n_updates=20000, update_assets=3, seed=0):
+    workload = synthetic_balance_stream(n_assets, n_updates, update_assets, seed)
+    order = [('balances', i) for i in range(n_updates)]
+    results = {}
+    for name in implementations or list(BALANCE_IMPLEMENTATIONS):
+        setup, apply = BALANCE_IMPLEMENTATIONS[name]
+        results[name] = run_implementation(setup, apply, workload, order)
+    return results
+
+
+def report(results, args):
+    print_results(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.check:
+        with open(args.check) as f:
+            regressions = check_regressions(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Market data pipeline benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    decode = subparsers.add_parser('decode', help='JSON decode + normalize throughput per backend')
+    decode.add_argument('--n', type=int, default=50000)
+    decode.add_argument('--levels', type=int, default=20)
+    decode.add_argument('--backend', action='append', dest='backends')
+
+    for name, implementations in (('book', BOOK_IMPLEMENTATIONS), ('balances', BALANCE_IMPLEMENTATIONS)):
+        sub = subparsers.add_parser(name, help=f'{name} update path: throughput, latency percentiles, allocations')
+        sub.add_argument('--impl', action='append', dest='implementations', choices=list(implementations))
+        sub.add_argument('--updates', type=int, default=20000)
+        sub.add_argument('--seed', type=int, default=0)
+        sub.add_argument('--save', help='write results as JSON')
+        sub.add_argument('--check', help='compare against saved JSON results, exit 1 on regression')
+        sub.add_argument('--tolerance', type=float, default=0.1)
+        if name == 'book':
+            sub.add_argument('--symbols', type=int, default=1)
+            sub.add_argument('--depth', type=int, default=1000)
+            sub.add_argument('--update-size', type=int, default=20)
+            sub.add_argument('--volatility', type=float, default=0.5, help='mid move per update, in ticks')
+        else:
+            sub.add_argument('--assets', type=int, default=50)
+            sub.add_argument('--update-assets', type=int, default=3)
+
+    args = parser.parse_args()
+    if args.benchmark == 'decode':
+        bench_decode(args.n, args.levels, args.backends)
+    elif args.benchmark == 'book':
+        report(bench_book(args.implementations, args.symbols, args.depth, args.updates, args.update_size,
+                          args.volatility, args.seed), args)
+    elif args.benchmark == 'balances':
+        report(bench_balances(args.implementations, args.assets, args.updates, args.update_assets, args.seed), args)
+
+
+if __name__ == '__main__':
+    main()
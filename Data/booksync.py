@@ -0,0 +1,160 @@
+import asyncio
+import time
+from collections import deque
+from data_handling import apply_diffs
+from orderbook import BOOK_SYNCING, BOOK_LIVE, BOOK_STALE
+
+
+class BookSync:
+    """
+    Sequencing state machine for one exchange|symbol book, never blocks the websocket:
+
+    SYNCING: no snapshot yet, diffs are buffered
+    LIVE:    diffs are applied as long as U <= last applied u + 1 <= u
+    STALE:   a sequence gap was detected, diffs are buffered until a new snapshot arrives
+
+    REST snapshots are fetched by a background task that routes the result into the book's own queue, so
+    it is ordered with the diffs. The buffered diffs are then replayed onto the snapshot per the U/u rules
+    (drop u <= lastUpdateId, first applied U <= lastUpdateId + 1 <= u).
+    event_time is the exchange time (E, seconds) of the latest diff applied or covered by a snapshot, the
+    book's time on the exchange clock (snapshots carry none).
+    """
+
+    def __init__(self, exchange, symbol, orderbook, queue, max_buffer=10000):
+        self.exchange = exchange
+        self.symbol = symbol.upper()
+        self.orderbook = orderbook
+        self.queue = queue
+        self.buffer = deque(maxlen=max_buffer)
+        self.snapshot_task = None
+        self.sync_started = time.time()
+        self.event_time = None
+        orderbook.sync_state = BOOK_SYNCING
+
+        self.snapshot_requests = 0
+        self.diffs_replayed = 0
+        self.diffs_discarded = 0
+        self.gaps = 0
+        self.resyncs = 0
+        self.last_sync_duration = None
+        self.max_resync_duration = 0.0
+        self.total_resync_duration = 0.0
+
+    @property
+    def state(self):
+        return self.orderbook.sync_state
+
+    @property
+    def synced(self):
+        return self.orderbook.sync_state == BOOK_LIVE
+
+    def request_snapshot(self):
+        """
+        Starts a background REST snapshot fetch unless one is running or the exchange sends snapshots in ws
+        """
+        if self.exchange.snapshot_in_ws:
+            return
+        if self.snapshot_task is not None and not self.snapshot_task.done():
+            return
+        self.snapshot_requests += 1
+        self.snapshot_task = asyncio.create_task(self._fetch_snapshot())
+
+    async def _fetch_snapshot(self):
+        delay = 0.5
+        while True:
+            try:
+                snapshot_msg = await self.exchange.orderbook_snapshot(self.symbol)
+                break
+            except Exception as e:
+                print(f'|{self.exchange.name}| {self.symbol} snapshot failed: {e}, retrying in {delay}s')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10)
+        self.queue.put_nowait(snapshot_msg)
+
+    def on_update(self, update_msg):
+        """
+        Applies an in-sequence diff to a live book. Returns False when the diff was buffered (book not live,
+        or a gap that marks it stale) or discarded as already applied.
+        """
+        orderbook = self.orderbook
+        if orderbook.sync_state != BOOK_LIVE:
+            self.buffer.append(update_msg)
+            self.request_snapshot()
+            return False
+
+        message = update_msg.message
+        if message.lastUpdateId <= orderbook.last_update_id:
+            self.diffs_discarded += 1
+            return False
+
+        if message.firstUpdateId > orderbook.last_update_id + 1:
+            self.gaps += 1
+            print(f'{self.exchange.name}|{self.symbol} Out of sync (expected {orderbook.last_update_id + 1}, '
+                  f'got {message.firstUpdateId}), re-syncing...')
+            self.mark_stale()
+            self.buffer.append(update_msg)
+            self.request_snapshot()
+            return False
+
+        apply_diffs(orderbook, update_msg)
+        self.event_time = message.eventTime / 1000
+        return True
+
+    def mark_stale(self):
+        if self.orderbook.sync_state == BOOK_LIVE:
+            self.orderbook.sync_state = BOOK_STALE
+            self.sync_started = time.time()
+            self.exchange.symbols_active[self.symbol] = False
+
+    def on_snapshot(self, snapshot_msg):
+        """
+        Applies a snapshot and replays the buffered diffs. Returns True when the book is live; False when
+        the snapshot is older than the buffered stream or the buffer has a gap, a newer one is then requested.
+        """
+        orderbook = self.orderbook
+        orderbook.apply_snapshot(snapshot_msg)
+        buffer = self.buffer
+
+        # already contained in the snapshot
+        while buffer and buffer[0].message.lastUpdateId <= orderbook.last_update_id:
+            self.event_time = buffer.popleft().message.eventTime / 1000
+            self.diffs_discarded += 1
+
+        while buffer:
+            message = buffer[0].message
+            if not message.firstUpdateId <= orderbook.last_update_id + 1 <= message.lastUpdateId:
+                # snapshot predates the oldest buffered diff or gap inside the buffer, keep the rest buffered
+                self.request_snapshot()
+                return False
+            apply_diffs(orderbook, buffer.popleft())
+            self.event_time = message.eventTime / 1000
+            self.diffs_replayed += 1
+
+        if orderbook.sync_state != BOOK_LIVE:
+            duration = time.time() - self.sync_started
+            self.last_sync_duration = duration
+            if orderbook.sync_state == BOOK_STALE:
+                self.resyncs += 1
+                self.total_resync_duration += duration
+                if duration > self.max_resync_duration:
+                    self.max_resync_duration = duration
+            orderbook.sync_state = BOOK_LIVE
+        self.exchange.symbols_active[self.symbol] = True
+        return True
+
+    def stats(self):
+        return {'state': self.state,
+                'buffered': len(self.buffer),
+                'snapshot_requests': self.snapshot_requests,
+                'gaps': self.gaps,
+                'resyncs': self.resyncs,
+                'last_sync_duration': self.last_sync_duration,
+                'max_resync_duration': self.max_resync_duration,
+                'avg_resync_duration': self.total_resync_duration / self.resyncs if self.resyncs else 0.0,
+                'diffs_replayed': self.diffs_replayed,
+                'diffs_discarded': self.diffs_discarded
+                }
+
+    def close(self):
+        if self.snapshot_task is not None:
+            self.snapshot_task.cancel()
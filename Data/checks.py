@@ -0,0 +1,212 @@
+"""
+Consistency checks for the book sequencing, analytics and bar paths, on synthetic streams
+
+    python checks.py                 # all checks
+    python checks.py booksync bars   # selected checks
+
+Exits 1 when a check fails.
+"""
+import argparse
+import random
+import sys
+import numpy as np
+import pandas as pd
+from benchmarks import book_workload
+from datatypes import BookMessage, SnapshotMessage, DepthUpdate
+from fixedpoint import SymbolScale
+from orderbook import OrderBook, BOOK_LIVE, BOOK_STALE
+from booksync import BookSync
+from analytics import BookAnalytics
+from bars import BarResampler
+
+
+class _CheckExchange:
+    # snapshots are supplied by the checks, BookSync never fetches one
+    name = 'Check'
+    snapshot_in_ws = True
+    symbols_active = {}
+
+
+def _book_stream(n_updates=300, depth=200, update_size=10, seed=0):
+    # (scale, snapshot BookMessage, [diff BookMessage, ...]) of one synthetic symbol, levels in fixed-point
+    streams, _ = book_workload(1, depth, n_updates, update_size, 0.5, seed)
+    symbol, (snapshot, diffs) = next(iter(streams.items()))
+    scale = SymbolScale(symbol, 2, 8)
+    snapshot = BookMessage('orderbook_snapshot', SnapshotMessage(symbol, snapshot['lastUpdateId'],
+                                                                 scale.decode_levels(snapshot['bids']),
+                                                                 scale.decode_levels(snapshot['asks'])),
+                           0.0, symbol, 'Check')
+    diffs = [BookMessage('orderbook_update', DepthUpdate(symbol, d['E'], d['U'], d['u'], scale.decode_levels(d['b']),
+                                                         scale.decode_levels(d['a'])), 0.0, symbol, 'Check')
+             for d in diffs]
+    return scale, snapshot, diffs
+
+
+def _reference(scale, snapshot, diffs, k):
+    # book after the first k diffs, applied in sequence onto the stream snapshot
+    book = OrderBook('Check', snapshot.symbol, scale=scale)
+    book.apply_snapshot(snapshot)
+    for msg in diffs[:k]:
+        book.apply_diffs(msg.message.bids, msg.message.asks, msg.message.lastUpdateId)
+    return book
+
+
+def _snapshot_of(book):
+    return BookMessage('orderbook_snapshot', SnapshotMessage(book.symbol, book.last_update_id, book.bid_side.top(),
+                                                             book.ask_side.top()), 0.0, book.symbol, 'Check')
+
+
+def _same_book(a, b):
+    return a.last_update_id == b.last_update_id and a.bid_side.top() == b.bid_side.top() \
+        and a.ask_side.top() == b.ask_side.top()
+
+
+def check_booksync():
+    scale, snapshot, diffs = _book_stream()
+    symbol = snapshot.symbol
+    failures = []
+
+    # buffered diffs are replayed onto a snapshot taken in the middle of the buffer
+    sync = BookSync(_CheckExchange, symbol, OrderBook('Check', symbol, scale=scale), None)
+    for msg in diffs[:40]:
+        if sync.on_update(msg):
+            failures.append('diff applied before the snapshot')
+            break
+    live = sync.on_snapshot(_snapshot_of(_reference(scale, snapshot, diffs, 15)))
+    if not live or sync.state != BOOK_LIVE:
+        failures.append(f'snapshot inside the buffer did not go live ({sync.state})')
+    if not _same_book(sync.orderbook, _reference(scale, snapshot, diffs, 40)):
+        failures.append('replayed book differs from the sequential book')
+    if (sync.diffs_discarded, sync.diffs_replayed) != (15, 25):
+        failures.append(f'discarded / replayed {sync.diffs_discarded} / {sync.diffs_replayed}, expected 15 / 25')
+    if sync.event_time != diffs[39].message.eventTime / 1000:
+        failures.append('snapshot event time is not the last replayed diff time')
+
+    # gap -> stale, later diffs buffered, resync snapshot -> live again
+    for msg in diffs[40:60]:
+        sync.on_update(msg)
+    if sync.on_update(diffs[61]) or sync.state != BOOK_STALE:
+        failures.append(f'gap did not mark the book stale ({sync.state})')
+    for msg in diffs[62:80]:
+        if sync.on_update(msg):
+            failures.append('diff applied while stale')
+            break
+    if not sync.on_snapshot(_snapshot_of(_reference(scale, snapshot, diffs, 70))):
+        failures.append('resync snapshot did not go live')
+    if not _same_book(sync.orderbook, _reference(scale, snapshot, diffs, 80)) or sync.resyncs != 1:
+        failures.append('resynced book differs from the sequential book')
+
+    # a snapshot older than the buffered stream keeps the book syncing
+    sync = BookSync(_CheckExchange, symbol, OrderBook('Check', symbol, scale=scale), None)
+    for msg in diffs[100:110]:
+        sync.on_update(msg)
+    if sync.on_snapshot(_snapshot_of(_reference(scale, snapshot, diffs, 50))) or sync.synced:
+        failures.append('snapshot older than the buffer went live')
+    return failures
+
+
+def check_analytics(n_updates=3000):
+    # incremental band depths against an engine that recomputes them on every update (full_refresh=1),
+    # both fed through their OrderBook; a resnapshot midway exercises on_snapshot
+    scale, snapshot, diffs = _book_stream(n_updates, depth=1000, update_size=20)
+    failures = []
+    for depth_bps in (1.0, 10.0):
+        engines = []
+        for full_refresh in (10 ** 9, 1):
+            book = OrderBook('Check', snapshot.symbol, scale=scale)
+            engines.append(BookAnalytics(book, depth_bps=depth_bps, full_refresh=full_refresh))
+            book.apply_snapshot(snapshot)
+        mismatches = 0
+        for i, msg in enumerate(diffs):
+            for analytics in engines:
+                book = analytics.orderbook
+                if i == len(diffs) // 2:
+                    book.apply_snapshot(_snapshot_of(book))
+                book.apply_diffs(msg.message.bids, msg.message.asks, msg.message.lastUpdateId)
+            incremental, full = (analytics.update() for analytics in engines)
+            mismatches += (incremental.bidDepth, incremental.askDepth) != (full.bidDepth, full.askDepth)
+        if mismatches:
+            failures.append(f'{depth_bps} bps band: {mismatches} incremental depths differ from a full recompute')
+    return failures
+
+
+def check_bars(n_events=100000, seed=1):
+    failures = []
+    rng = random.Random(seed)
+    t = 1700000000.0
+    mid = 100.0
+    resampler = BarResampler('Check', 'CHECKUSD', (0.1, 1, 60), history=5000)
+    quotes = []
+    trades = []
+    for _ in range(n_events):
+        t += rng.expovariate(1 / 0.002)
+        if rng.random() < 0.7:
+            mid += rng.gauss(0, 0.01)
+            quotes.append((t, mid))
+            resampler.on_quote(t, mid)
+        else:
+            price = mid + rng.choice((-0.005, 0.005))
+            quantity = rng.random()
+            trades.append((t, price, quantity))
+            resampler.on_trade(t, price, quantity, price > mid)
+    resampler.flush(t + 100)
+
+    quotes = pd.DataFrame(quotes, columns=['t', 'mid'])
+    trades = pd.DataFrame(trades, columns=['t', 'price', 'quantity'])
+    for resolution in (0.1, 1, 60):
+        span = int(resolution * 1000)
+        bars = pd.DataFrame(resampler.history(resolution).views())
+        bars.index = np.round(bars['timestamp'] * 1000 / span).astype(np.int64)
+        ohlc = quotes.groupby((quotes['t'] * 1000).astype(np.int64) // span)['mid'].agg(['max', 'last'])
+        volume = trades.groupby((trades['t'] * 1000).astype(np.int64) // span)['quantity'].sum()
+        common = bars.index.intersection(ohlc.index)
+        # bars open at the previous close, so their high also covers it
+        if not np.allclose(bars.loc[common, 'high'], np.maximum(ohlc.loc[common, 'max'], bars.loc[common, 'open'])):
+            failures.append(f'{resolution}s bar highs differ from a groupby')
+        if not np.allclose(bars.loc[common, 'close'], ohlc.loc[common, 'last']):
+            failures.append(f'{resolution}s bar closes differ from a groupby')
+        if not np.allclose(bars['volume'].reindex(volume.index), volume):
+            failures.append(f'{resolution}s bar volumes differ from a groupby')
+        if bars['trades'].sum() != len(trades):
+            failures.append(f'{resolution}s bars count {bars["trades"].sum()} trades, expected {len(trades)}')
+
+    # recorded (old) exchange times flushed on the exchange clock stay in their own minute bar
+    resampler = BarResampler('Check', 'CHECKUSD', (0.1, 60))
+    start = 1672515782.0
+    for i in range(50):
+        resampler.on_quote(start + i * 0.1, 100.0 + i)
+        resampler.flush(resampler.exchange_time() - 0.25)
+    minute = [bar for bar in resampler.flush(start + 60) if bar.resolution == 60]
+    if len(resampler.history(60)) != 1 or not minute or minute[0].quotes != 50 \
+            or minute[0].startTime != int(start) // 60 * 60:
+        failures.append('exchange clock flush moved recorded events into later minute bars')
+    return failures
+
+
+CHECKS = {
+    'booksync': check_booksync,
+    'analytics': check_analytics,
+    'bars': check_bars,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Book sequencing, analytics and bar consistency checks')
+    parser.add_argument('checks', nargs='*', help=f'checks to run ({", ".join(CHECKS)}), all by default')
+    args = parser.parse_args()
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f'unknown checks: {", ".join(unknown)}')
+
+    failed = False
+    for name in args.checks or list(CHECKS):
+        failures = CHECKS[name]()
+        print(f'{name:<10}{"ok" if not failures else "FAILED"}')
+        for failure in failures:
+            print(f'    {failure}')
+        failed = failed or bool(failures)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
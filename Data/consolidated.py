@@ -0,0 +1,175 @@
+from heapq import merge
+from typing import Dict
+from datatypes import ConsolidatedTop, CrossedMarket
+
+
+class VenueQuote:
+    """
+    Top levels of one exchange's book as float [price, quantity] rows, best first, with its fee rate
+    """
+    __slots__ = ('exchange', 'raw', 'bids', 'asks', 'fee')
+
+    def __init__(self, exchange, raw, bids, asks, fee):
+        self.exchange = exchange
+        self.raw = raw
+        self.bids = bids
+        self.asks = asks
+        self.fee = fee
+
+    def net_bid(self):
+        return self.bids[0][0] * (1 - self.fee) if self.bids else None
+
+    def net_ask(self):
+        return self.asks[0][0] * (1 + self.fee) if self.asks else None
+
+
+def _cross_quantity(bids, asks, bid_fee, ask_fee):
+    # size that can be sold into bids and bought from asks with the net bid above the net ask
+    i = j = 0
+    bid_left = bids[0][1] if bids else 0
+    ask_left = asks[0][1] if asks else 0
+    quantity = 0.0
+    while i < len(bids) and j < len(asks) and bids[i][0] * (1 - bid_fee) > asks[j][0] * (1 + ask_fee):
+        take = min(bid_left, ask_left)
+        quantity += take
+        bid_left -= take
+        ask_left -= take
+        if bid_left <= 0:
+            i += 1
+            bid_left = bids[i][1] if i < len(bids) else 0
+        if ask_left <= 0:
+            j += 1
+            ask_left = asks[j][1] if j < len(asks) else 0
+    return quantity
+
+
+class ConsolidatedBook:
+    """
+    One instrument across exchanges: per venue top `levels` levels merged into a best-price ladder with venue
+    attribution and fee adjusted (net) prices. `liquidity` picks the fee rate applied, 'taker' (crossing the
+    spread, the arbitrage case) or 'maker'. Work is done only when a venue's top levels change: the venue's
+    rows are converted once, best bid / ask and crosses are found from the venues' tops (O(venues)) and the
+    full ladder is merged lazily on request.
+    """
+
+    def __init__(self, symbol, levels=5, liquidity='taker'):
+        self.symbol = symbol.upper()
+        self.levels = levels
+        self.liquidity = liquidity
+        self.venues: Dict[str, VenueQuote] = {}
+        self.fees = {}
+        self.top = None
+        self.cross = None
+        self._top_state = None
+        self._ladder = None
+
+    def set_fees(self, exchange, maker_fee, taker_fee):
+        self.fees[exchange] = (maker_fee or 0.0, taker_fee or 0.0)
+        venue = self.venues.get(exchange)
+        if venue is not None:
+            venue.fee = self._fee(exchange)
+
+    def _fee(self, exchange):
+        maker_fee, taker_fee = self.fees.get(exchange, (0.0, 0.0))
+        return taker_fee if self.liquidity == 'taker' else maker_fee
+
+    def update(self, orderbook, event_time=None):
+        """
+        Takes a venue's current book, returns (ConsolidatedTop or None, CrossedMarket or None) events, None for
+        the ones that did not change
+        """
+        n = self.levels
+        raw = (orderbook.bid_side.top(n), orderbook.ask_side.top(n))
+        venue = self.venues.get(orderbook.exchange)
+        if venue is not None and venue.raw == raw:
+            return None, None
+
+        price_factor = orderbook.scale.price_factor
+        qty_factor = orderbook.scale.qty_factor
+        bids = [[price / price_factor, quantity / qty_factor] for price, quantity in raw[0]]
+        asks = [[price / price_factor, quantity / qty_factor] for price, quantity in raw[1]]
+        if venue is None:
+            self.venues[orderbook.exchange] = VenueQuote(orderbook.exchange, raw, bids, asks,
+                                                         self._fee(orderbook.exchange))
+        else:
+            venue.raw, venue.bids, venue.asks = raw, bids, asks
+        self._ladder = None
+        return self._refresh(orderbook.timestamp if event_time is None else event_time)
+
+    def remove(self, exchange, event_time=None):
+        """
+        Drops a venue (e.g. its book went stale), returns events like update
+        """
+        if self.venues.pop(exchange, None) is None:
+            return None, None
+        self._ladder = None
+        return self._refresh(event_time)
+
+    def _refresh(self, event_time):
+        venues = self.venues.values()
+        bid_venues = sorted((v for v in venues if v.bids), key=VenueQuote.net_bid, reverse=True)
+        ask_venues = sorted((v for v in venues if v.asks), key=VenueQuote.net_ask)
+
+        top_event = None
+        best_bid = bid_venues[0] if bid_venues else None
+        best_ask = ask_venues[0] if ask_venues else None
+        top = (best_bid.exchange if best_bid else None, best_bid.bids[0] if best_bid else None,
+               best_ask.exchange if best_ask else None, best_ask.asks[0] if best_ask else None)
+        if top != self._top_state:
+            self._top_state = top
+            self.top = top_event = self._top_event(event_time, best_bid, best_ask)
+
+        cross_event = None
+        cross = self._find_cross(bid_venues, ask_venues, event_time)
+        if cross is None:
+            self.cross = None
+        elif self.cross is None or cross[2:] != self.cross[2:]:
+            self.cross = cross_event = cross
+        return top_event, cross_event
+
+    def _top_event(self, event_time, best_bid, best_ask):
+        bid_price, bid_qty = best_bid.bids[0] if best_bid else (None, None)
+        ask_price, ask_qty = best_ask.asks[0] if best_ask else (None, None)
+        bid_net = best_bid.net_bid() if best_bid else None
+        ask_net = best_ask.net_ask() if best_ask else None
+        spread_bps = net_spread_bps = None
+        if best_bid and best_ask:
+            mid = (bid_price + ask_price) / 2
+            spread_bps = (ask_price - bid_price) / mid * 1e4
+            net_spread_bps = (ask_net - bid_net) / mid * 1e4
+        return ConsolidatedTop(self.symbol, event_time, best_bid.exchange if best_bid else None, bid_price, bid_qty,
+                               bid_net, best_ask.exchange if best_ask else None, ask_price, ask_qty, ask_net,
+                               spread_bps, net_spread_bps)
+
+    def _find_cross(self, bid_venues, ask_venues, event_time):
+        # best net bid / ask pair on different exchanges, only the top two of each side can form it
+        best = None
+        for seller in bid_venues[:2]:
+            for buyer in ask_venues[:2]:
+                if seller is buyer:
+                    continue
+                edge = seller.net_bid() - buyer.net_ask()
+                if edge > 0 and (best is None or edge > best[0]):
+                    best = (edge, seller, buyer)
+        if best is None:
+            return None
+
+        edge, seller, buyer = best
+        sell_price = seller.bids[0][0]
+        buy_price = buyer.asks[0][0]
+        mid = (sell_price + buy_price) / 2
+        return CrossedMarket(self.symbol, event_time, buyer.exchange, buy_price, seller.exchange, sell_price,
+                             _cross_quantity(seller.bids, buyer.asks, seller.fee, buyer.fee),
+                             (sell_price - buy_price) / mid * 1e4, edge / mid * 1e4)
+
+    def ladder(self):
+        """
+        Merged ([bids], [asks]) of (price, quantity, exchange, net price) rows, best first
+        """
+        if self._ladder is None:
+            bids = merge(*([(price, quantity, v.exchange, price * (1 - v.fee)) for price, quantity in v.bids]
+                           for v in self.venues.values()), key=lambda row: -row[0])
+            asks = merge(*([(price, quantity, v.exchange, price * (1 + v.fee)) for price, quantity in v.asks]
+                           for v in self.venues.values()), key=lambda row: row[0])
+            self._ladder = (list(bids), list(asks))
+        return self._ladder
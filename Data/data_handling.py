@@ -1,158 +1,144 @@
 import asyncio
-import time
-from datatypes import position_msg
+import numpy as np
+import pandas as pd
+from storage import read_stream
 from exchanges import binance_us
 
 exchange_key = {
     'BinanceUS': binance_us
 }
 
+BALANCE_COLUMNS = ['timestamp', 'exchange', 'asset', 'amount']
+
 
 def apply_diffs(ob, update_msg):
     """
-    Updates local order book's bid or ask lists based on the received update ([price, quantity])
+    Updates local order book's bid and ask sides based on the received update ([price, quantity])
     """
+    message = update_msg.message
+    ob.apply_diffs(message.bids, message.asks, message.lastUpdateId)
+    return ob
 
-    order_book = {
-        'messageType': 'live_orderbook',
-        'message': {'lastUpdateId': update_msg['message']['lastUpdateId'],
-                    'bids': ob['message']['bids'],
-                    'asks': ob['message']['asks']
-                    },
-        'timestamp': time.time(),
-        'symbol': ob['symbol'].upper(),
-        'exchange': ob['exchange']
-    }
-    sides = ['bids', 'asks']
-
-    for side in sides:
-        for update in update_msg['message'][side]:
-            price, quantity = update
-            found = False
-            # price exists: remove or update local order
-            for i in range(0, len(order_book['message'][side])):
-
-                if price == order_book['message'][side][i][0]:
-                    # quantity is 0: remove
-                    if float(quantity) == 0:
-                        order_book['message'][side].pop(i)
-                        found = True
-                        break
-                    else:
-                        # quantity is not 0: update the order with new quantity
-                        order_book['message'][side][i] = update
-                        found = True
-                        break
-
-                # price not found: add new order
-            if not found and float(quantity) != 0:
-                order_book['message'][side].append(update)
-                if side == 'asks':
-                    order_book['message'][side] = sorted(order_book['message'][side])  # asks prices in ascendant order
-                else:
-                    order_book['message'][side] = sorted(order_book['message'][side],
-                                                         reverse=True)  # bids prices in descendant order
-                # maintain side depth <= 1000
-                if len(order_book['message'][side]) > 1000:
-                    order_book['message'][side].pop(len(order_book['message'][side]) - 1)
-
-    return order_book
-
-
-def apply_balance_updates(snapshot, update_msg):
-    #snapshot = snapshot[update_msg['exchange']]
-    if update_msg['msgType'] == 'snapshot':
-        return update_msg
 
-    else:
-        update_bals = update_msg['balances']
-        snapshot_bals = snapshot['balances']
-        for x in update_bals:
-            #      asset       free balance       locked balance
-            b = [x.get('a'), float(x.get('f')), float(x.get('l'))]
-            for i, bal in enumerate(snapshot_bals):
-                # match found -> remove old balance -> add new balance
-                if bal[0] == b[0]:
-                    snapshot_bals.pop(i)
-                    snapshot_bals.append(b)
-                else:
-                    continue
-        msg = {
-            'eventTime': update_msg['eventTime'],
-            'balances': snapshot_bals
-        }
-        return msg
+def apply_balance_updates(balances, update_msg):
+    """
+    Applies a balance snapshot / update message to an asset-keyed Balances, returns the Balance records that
+    changed
+    """
+    if update_msg.msgType == 'snapshot':
+        return balances.apply_snapshot(update_msg.eventTime, update_msg.balances)
+    return balances.apply_update(update_msg.eventTime, update_msg.balances)
 
 
 def order_message_handler(open_orders, open_positions, msg):
-    symbol = msg['symbol']
+    """
+    Applies an execution report to the OrderStore (open_orders); fills are appended to open_positions
+    """
+    symbol = msg.symbol
 
-    exchange = msg['exchange']
+    exchange = msg.exchange
 
-    orderId = msg['clientOrderID']
-    ts = msg['eventTime']
+    orderId = msg.clientOrderID
+    ts = msg.eventTime
 
-    # add order to open_orders
-    if msg['executionType'] == 'NEW' and msg['orderType'] == 'LIMIT':
-        open_orders.append(msg)
-        print('NEW LIMIT ORDER')
+    fill = open_orders.apply(msg)
 
-    # cancellation - remove order from open_orders
-    if msg['executionType'] == 'CANCELED':
-        for i, order in enumerate(open_orders):
-            if order['clientOrderID'] == msg['origClientOrderID']:
-                open_orders.pop(i)
-                print('CANCELLED LIMIT ORDER')
+    if msg.executionType == 'NEW' and msg.orderType == 'LIMIT':
+        print('NEW LIMIT ORDER')
 
-    # trade - remove order from open_orders, add position to open_positions
-    if msg['executionType'] == 'TRADE':
-        if msg['orderType'] == 'LIMIT':
-            for i, order in enumerate(open_orders):
-                if order['clientOrderID'] == msg['origClientOrderID']:
-                    open_orders.pop(i)
-                    open_positions.append(position_msg(msg, exchange.name))
+    if msg.executionType == 'CANCELED':
+        print('CANCELLED LIMIT ORDER')
 
-        if msg['orderType'] == 'MARKET':
-            open_positions.append(position_msg(msg, exchange))
+    # trade - order updated / removed by the store, add fill to open_positions
+    if fill is not None:
+        open_positions.append(fill)
 
     # order rejected - log rejection message
-    if msg['executionType'] == 'REJECTED':
+    if msg.executionType == 'REJECTED':
         print(f'| ORDER REJECTED | {exchange} | {symbol} | {ts} | {orderId} |')
 
-    # order expired - remove from open_orders if limit order, send no_fill message
-    if msg['executionType'] == 'EXPIRED':
-        if msg['orderType'] == 'LIMIT':
-            for i, order in enumerate(open_orders):
-                if order['clientOrderID'] == msg['origClientOrderID']:
-                    open_orders.pop(i)
-        print(f'| ORDER EXPIRED | {exchange.name} | {symbol} | {ts} | {orderId} |')
+    # order expired - log no_fill message
+    if msg.executionType == 'EXPIRED':
+        print(f'| ORDER EXPIRED | {exchange} | {symbol} | {ts} | {orderId} |')
 
     return open_orders, open_positions
 
 
-async def orderbook_update_handler(exchange, symbol, orderbook, update_msg):
-    outofsync_count = 0
-    # message handler - update snapshot
-    if update_msg['message']['lastUpdateId'] <= orderbook['message']['lastUpdateId']:
-        print(f'{exchange.name}|{symbol} Not an update')
+def orderbook_update_handler(book_sync, update_msg):
+    """
+    Applies a diff through the book's BookSync: in-sequence diffs update the book, a sequence gap marks it
+    stale and resyncs it in the background. Returns True when the diff was applied.
+    """
+    return book_sync.on_update(update_msg)
 
-    if update_msg['message']['firstUpdateId'] <= orderbook['message'][
-        'lastUpdateId'] + 1 <= \
-            update_msg['message']['lastUpdateId']:
-        orderbook = apply_diffs(orderbook, update_msg)
 
+def equity_curve(balances, mids, freq=None, since=None, quote='USD'):
+    """
+    Vectorized NAV over time for any number of exchanges / assets.
+    balances: DataFrame of timestamp, exchange, asset, amount rows (balance snapshots, see balance_rows);
+    mids: {(exchange, symbol): (timestamps, mid prices)} sorted arrays, e.g. BBA history.
+    Every exchange|asset balance and its asset + quote mid series are aligned to the evaluation times with
+    np.searchsorted (last value at or before t). Times are the union of all series, or a `freq` second grid;
+    `since` keeps only later times for incremental updates. Assets without a mid series are left out;
+    nav is NaN until every included asset has a price.
+    """
+    balances = balances.sort_values('timestamp', kind='stable')
+    series = [np.asarray(ts) for ts, _ in mids.values() if len(ts)]
+    if len(balances):
+        series.append(balances['timestamp'].to_numpy())
+    if not series:
+        return pd.DataFrame({'nav': []}, index=pd.Index([], name='timestamp'))
+
+    if freq:
+        start = min(s[0] for s in series)
+        end = max(s[-1] for s in series)
+        times = np.arange(np.floor(start / freq) * freq, end + freq, freq)
     else:
-
-        if exchange.snapshot_in_ws:
-            print(print(f'{exchange.name}|{symbol} Out of sync, re-syncing...'))
-        else:
-            outofsync_count += 1
-            if outofsync_count % 5 == 0:
-                orderbook = await exchange.orderbook_snapshot(symbol=symbol.upper())
-                print(f'{exchange.name}|{symbol} Out of sync, re-syncing...')
-
-    return orderbook
+        times = np.unique(np.concatenate(series))
+    if since is not None:
+        times = times[times > since]
+
+    values = {}
+    for (exchange, asset), group in balances.groupby(['exchange', 'asset'], sort=False):
+        i = np.searchsorted(group['timestamp'].to_numpy(), times, side='right') - 1
+        amount = np.where(i >= 0, group['amount'].to_numpy(dtype=float)[np.maximum(i, 0)], 0.0)
+        if asset == quote:
+            values[f'{exchange}|{asset}'] = amount
+            continue
+
+        mid = mids.get((exchange, asset + quote))
+        if mid is None or not len(mid[0]):
+            continue
+        mid_times, mid_prices = np.asarray(mid[0]), np.asarray(mid[1])
+        j = np.searchsorted(mid_times, times, side='right') - 1
+        price = np.where(j >= 0, mid_prices[np.maximum(j, 0)], np.nan)
+        values[f'{exchange}|{asset}'] = np.where(amount == 0, 0.0, amount * price)
+
+    curve = pd.DataFrame(values, index=pd.Index(times, name='timestamp'))
+    curve['nav'] = curve.sum(axis=1, skipna=False) if values else np.nan
+    return curve
+
+
+def balance_rows(exchange, event_time, balances):
+    """
+    Long-form balance rows (timestamp, exchange, asset, amount) from Balance records, amount = free + locked
+    """
+    return [(event_time, exchange, b.asset, b.free + b.locked) for b in balances]
 
 
-def equity_curve(freq, trades):
-    now = time.time()
+def historical_equity_curve(data_dir, exchange_names, symbols, freq=None, quote='USD'):
+    """
+    equity_curve over the BBA and balance history persisted by MasterDatafeed's ParquetWriter
+    """
+    mids = {}
+    for exchange in exchange_names:
+        for symbol in symbols:
+            bba = read_stream(data_dir, f'BBA/{exchange}/{symbol}', columns=['timestamp', 'midprice'])
+            if len(bba):
+                bba = bba.sort_values('timestamp', kind='stable')
+                mids[(exchange, symbol)] = (bba['timestamp'].to_numpy(), bba['midprice'].to_numpy())
+    balances = pd.concat([read_stream(data_dir, f'BALANCES/{exchange}') for exchange in exchange_names],
+                         ignore_index=True)
+    if not len(balances):
+        balances = pd.DataFrame(columns=BALANCE_COLUMNS)
+    return equity_curve(balances, mids, freq=freq, quote=quote)
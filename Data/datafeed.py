@@ -1,69 +1,317 @@
 import asyncio
+import os
+import time
+from collections import deque
 from exchanges import binance_us
 import json
-from data_handling import order_message_handler, apply_balance_updates, orderbook_update_handler
-import numpy as np
+from data_handling import order_message_handler, apply_balance_updates, orderbook_update_handler, \
+    equity_curve, balance_rows, BALANCE_COLUMNS
+from orderbook import OrderBook, BOOK_LIVE
+from booksync import BookSync
+from routing import OrderBookRouter
+from ringbuffer import RingBuffer
+from events import EventBus, ALL
+from storage import ParquetWriter
+from recorder import FeedRecorder
+from telemetry import LatencyMonitor
+from analytics import BookAnalytics
+from consolidated import ConsolidatedBook
+from trades import TradeTape
+from bars import BarResampler, resolution_label
+from sharedbook import FeedProcess
+from orders import OrderStore
+from positions import PositionEngine
+from balances import Balances
+from datatypes import BalanceMessage
 import fastparquet as fp
 import pandas as pd
 
 
 # use uv loop
 
+BBA_COLUMNS = ['timestamp', 'best_bid', 'best_ask', 'midprice', 'bid_size', 'ask_size']
+
+
 class MasterDatafeed:
 
     def __init__(self,
                  exchange_list,
-                 symbols
+                 symbols,
+                 data_dir=None,
+                 record_dir=None,
+                 shared_books=None,
+                 analytics_config=None,
+                 consolidated_levels=5,
+                 trade_windows=(1, 10, 60),
+                 store_trades=False,
+                 bar_resolutions=(0.1, 1, 60)
                  ):
         self.balances = {}
-        self.open_orders = []
-        self.open_positions = []
+        # long-form balance history for equity_curve, persisted in batches of balance_batch rows and trimmed to
+        # the BBA window (see trim_balance_history)
+        self.balance_history = []
+        self.balance_history_stored = 0
+        self.balance_batch = 100
+        self.open_orders = OrderStore()
+        # recent fills, positions / PnL are kept by the PositionEngine
+        self.open_positions = deque(maxlen=10000)
+        self.positions = PositionEngine()
         self.symbols = symbols
         self.order_books = {}
         self.BBA = {}
         self.exchange_list = exchange_list
+        self.exchanges = {exchange.name: exchange for exchange in exchange_list}
         self.order_books_active = {}
-        self.orderbook_update_queue = asyncio.Queue()
+        self.book_sync = {}
+        self.orderbook_router = OrderBookRouter()
+        # pub/sub surface: subscribe(topic, key) wakes consumers on every event, see events.EventBus
+        self.events = EventBus()
+        # live OrderBook per exchange|symbol after every applied change, ExecutionReports and fills (Position)
+        # per exchange|symbol
+        self.book_events = self.events.topic('book')
+        self.order_events = self.events.topic('orders')
+        self.fill_events = self.events.topic('fills')
+        self.top_of_book = self.events.topic('top_of_book')
+        # per book BookAnalytics, BookAnalytics keyword arguments in analytics_config
+        self.analytics = {}
+        self.analytics_config = analytics_config or {}
+        self.book_features = self.events.topic('book_features')
+        # cross-exchange view per symbol, ConsolidatedTop / CrossedMarket events keyed by symbol
+        self.consolidated = {symbol.upper(): ConsolidatedBook(symbol, consolidated_levels) for symbol in symbols}
+        self.consolidated_top = self.events.topic('consolidated')
+        self.crossed_markets = self.events.topic('crossed_markets')
+        # per book trade tapes with rolling windows (seconds), persisted in batches of trade_batch trades
+        self.trade_tapes = {}
+        self.trade_windows = trade_windows
+        self.store_trades = store_trades
+        self.trade_batch = 1000
+        self.trade_stats = self.events.topic('trade_stats')
+        self.trade_events = self.events.topic('trades')
+        # per book multi-resolution bars, completed bars keyed by exchange|symbol|resolution, stored in batches
+        self.bars = {}
+        self.bar_resolutions = bar_resolutions
+        self.bar_events = self.events.topic('bars')
+        self.bar_batch = 100
+        # bars of quiet books are closed this long after their end on the (estimated) exchange clock
+        self.bar_delay = 0.25
+        # per exchange BalanceMessage('update', eventTime, [changed Balance, ...]) events
+        self.balance_events = self.events.topic('balances')
+        self.latency = LatencyMonitor()
         self.order_message_queue = asyncio.Queue()
-        self.balance_message_queue = asyncio.Queue()
+        # one balance queue per exchange account, so a venue's messages only reach its own Balances
+        self.balance_queues = {exchange.name: asyncio.Queue() for exchange in exchange_list}
         self.ob_stream_active = False
         self.userdata_stream_active = False
         self.equity_tracking = False
+        # feed process mode: books are published into a SharedBookSegment for the parent process
+        self.shared_books = shared_books
+        self.feed_processes = {}
+        self.closed = False
+        # market data persistence, disabled without an output directory
+        self.storage = ParquetWriter(data_dir) if data_dir is not None else None
+        # raw feed recording for offline replay (see replay.ReplayDataSource)
+        if record_dir is not None:
+            session = time.strftime('%Y%m%d-%H%M%S')
+            for exchange in exchange_list:
+                exchange.recorder = FeedRecorder(os.path.join(record_dir, f'{exchange.name}-{session}.feed'))
 
     async def initialize_queues(self):
         for exchange in self.exchange_list:
             for symbol in self.symbols:
                 ob_id = exchange.name + '|' + symbol
-                self.order_books[ob_id] = {}
+                self.order_books[ob_id] = OrderBook(exchange.name, symbol, scale=exchange.get_scale(symbol))
 
     async def initialize_datafeeds(self):
         for exchange in self.exchange_list:
+            await exchange.warm_up()
+            await exchange.load_symbol_scales()
             await exchange.get_listen_key()
-            await exchange.userdata_snapshot(balance_queue=self.balance_message_queue)
+            await exchange.userdata_snapshot(balance_queue=self.balance_queues[exchange.name])
+            self.positions.set_fees(exchange.name, exchange.maker_fee, exchange.taker_fee)
+            for consolidated in self.consolidated.values():
+                consolidated.set_fees(exchange.name, exchange.maker_fee, exchange.taker_fee)
             await self.initialize_queues()
 
     async def get_orderbooks(self, exchange):
-
+        """
+        Runs one consumer per symbol of the exchange, each draining its own routed queue
+        """
         for symbol in exchange.symbols:
-            self.order_books_active[exchange.name + '|' + symbol] = False
+            self.order_books_active[exchange.name + '|' + symbol.upper()] = False
 
-        while not self.ob_stream_active:
-            self.ob_stream_active = True
-            while True:
-                msg = await self.orderbook_update_queue.get()
-                ob_id = msg['exchange'] + '|' + msg['symbol']
+        self.ob_stream_active = True
+        async with asyncio.TaskGroup() as tg:
+            for symbol in exchange.symbols:
+                tg.create_task(self.get_orderbook(exchange, symbol.upper()))
 
-                if msg['messageType'] == 'orderbook_snapshot':
-                    self.order_books[ob_id] = msg
+    async def get_orderbook(self, exchange, symbol):
+        ob_id = exchange.name + '|' + symbol
+        queue = self.orderbook_router.queue(exchange.name, symbol)
+
+        if ob_id not in self.order_books:
+            self.order_books[ob_id] = OrderBook(exchange.name, symbol, scale=exchange.get_scale(symbol))
+        orderbook = self.order_books[ob_id]
+
+        stats = self.latency.pipeline(ob_id)
+        sync = BookSync(exchange, symbol, orderbook, queue)
+        self.book_sync[ob_id] = sync
+        analytics = self.analytics[ob_id] = BookAnalytics(orderbook, **self.analytics_config)
+        consolidated = self.consolidated.get(symbol)
+        top = orderbook.top()
+        try:
+            while True:
+                msg = await queue.get()
+                get_time = time.time()
+
+                changed = True
+                snapshot = msg.messageType == 'orderbook_snapshot'
+                if snapshot:
+                    stats.snapshots += 1
+                    sync.on_snapshot(msg)
+                    # exchange time of the diffs the snapshot covers, events wait for a diff without one
+                    event_time = sync.event_time
+                    changed = event_time is not None
+                elif orderbook_update_handler(sync, msg):
+                    stats.record_update(msg, get_time, time.time(), queue.qsize())
+                    event_time = msg.message.eventTime / 1000
                 else:
-                    self.order_books[ob_id] = await orderbook_update_handler(exchange, msg['symbol'],
-                                                                             self.order_books[ob_id], msg)
-                    if self.order_books[ob_id]['messageType'] == 'live_orderbook' \
-                            and not self.order_books_active[ob_id]:
-                        print(f'{ob_id} order book active')
-                        self.order_books_active[ob_id] = True
-                    else:
-                        continue
+                    # not live: buffered until the (background) snapshot arrives, or already applied
+                    changed = False
+
+                live = orderbook.sync_state == BOOK_LIVE
+                state_changed = live != self.order_books_active[ob_id]
+                # buffered / discarded diffs leave the shared book as it is
+                if self.shared_books is not None and (changed or snapshot or state_changed):
+                    self.shared_books.publish(orderbook)
+
+                if state_changed:
+                    self.order_books_active[ob_id] = live
+                    print(f'{ob_id} order book {"active" if live else orderbook.sync_state}')
+                    if not live and consolidated is not None:
+                        # stale quotes would show phantom crosses
+                        self.publish_consolidated(symbol, consolidated.remove(exchange.name, sync.event_time))
+                # stale / syncing books are not published
+                if not live or not changed:
+                    continue
+
+                if consolidated is not None:
+                    self.publish_consolidated(symbol, consolidated.update(orderbook, event_time))
+
+                if self.book_events.has_subscribers(ob_id):
+                    self.book_events.publish(ob_id, orderbook)
+
+                features = analytics.update(event_time)
+                if features is not None and self.book_features.has_subscribers(ob_id):
+                    self.book_features.publish(ob_id, features)
+
+                # emit only when best bid / ask price or size changed
+                new_top = orderbook.top()
+                if new_top != top:
+                    top = new_top
+                    if self.top_of_book.has_subscribers(ob_id):
+                        self.top_of_book.publish(ob_id, orderbook.top_of_book(event_time, top))
+        finally:
+            sync.close()
+
+    async def get_trades(self, exchange):
+        """
+        Consumes the exchange's decoded trades into per symbol TradeTapes
+        """
+        queue = exchange.trade_queue = asyncio.Queue()
+        while True:
+            trade = await queue.get()
+            symbol = trade.symbol.upper()
+            ob_id = exchange.name + '|' + symbol
+            tape = self.trade_tapes.get(ob_id)
+            if tape is None:
+                tape = self.trade_tapes[ob_id] = TradeTape(exchange.name, symbol, exchange.get_scale(symbol),
+                                                           self.trade_windows)
+            tape.on_trade(trade)
+
+            if self.trade_events.has_subscribers(ob_id):
+                self.trade_events.publish(ob_id, trade)
+            if self.trade_stats.has_subscribers(ob_id):
+                self.trade_stats.publish(ob_id, tape.stats())
+            if self.store_trades and self.storage is not None and tape.tape.pending() >= self.trade_batch:
+                self.storage.write(f'TRADES/{exchange.name}/{symbol}', tape.export())
+
+    def subscribe_trades(self, exchange, symbol, conflation=None, latest=False):
+        """
+        Subscription yielding the exchange|symbol TradeUpdates (fixed-point)
+        """
+        return self.trade_events.subscribe(exchange.name + '|' + symbol.upper(), conflation, latest)
+
+    def subscribe_trade_stats(self, exchange, symbol, conflation=None, latest=False):
+        """
+        Subscription yielding {window: TradeStats} for exchange|symbol after every trade
+        """
+        return self.trade_stats.subscribe(exchange.name + '|' + symbol.upper(), conflation, latest)
+
+    def rolling_trade_stats(self, exchange_name, symbol, now=None):
+        """
+        {window: TradeStats} of a trade tape aged to now (seconds), None before its first trade
+        """
+        tape = self.trade_tapes.get(exchange_name + '|' + symbol.upper())
+        return tape.stats(now) if tape is not None else None
+
+    async def report_latency(self, interval=60):
+        """
+        Prints per book stage latency percentiles, throughput and queue depth every interval seconds
+        """
+        while True:
+            await asyncio.sleep(interval)
+            print(self.latency.report())
+            for ob_id, sync in self.book_sync.items():
+                stats = sync.stats()
+                if stats['resyncs'] or stats['state'] != BOOK_LIVE:
+                    print(f"{ob_id} {stats['state']}, resyncs: {stats['resyncs']}, gaps: {stats['gaps']}, "
+                          f"avg resync: {stats['avg_resync_duration'] * 1000:.0f}ms, "
+                          f"max resync: {stats['max_resync_duration'] * 1000:.0f}ms, buffered: {stats['buffered']}")
+
+    def publish_consolidated(self, symbol, events):
+        top, cross = events
+        if top is not None and self.consolidated_top.has_subscribers(symbol):
+            self.consolidated_top.publish(symbol, top)
+        if cross is not None and self.crossed_markets.has_subscribers(symbol):
+            self.crossed_markets.publish(symbol, cross)
+
+    def subscribe_consolidated(self, symbol, conflation=None, latest=False):
+        """
+        Subscription yielding ConsolidatedTop events for symbol whenever the best venue bid / ask changes
+        """
+        return self.consolidated_top.subscribe(symbol.upper(), conflation, latest)
+
+    def subscribe_crossed_markets(self, symbol, conflation=None, latest=False):
+        """
+        Subscription yielding CrossedMarket events for symbol while one exchange's bid is above another's ask
+        after fees
+        """
+        return self.crossed_markets.subscribe(symbol.upper(), conflation, latest)
+
+    def subscribe_balances(self, exchange, conflation=None, latest=False):
+        """
+        Subscription yielding the balances of exchange that changed, per balance message
+        """
+        return self.balance_events.subscribe(exchange.name, conflation, latest)
+
+    def subscribe_book_features(self, exchange, symbol, conflation=None, latest=False):
+        """
+        Subscription yielding BookFeatures for exchange|symbol after every book change
+        """
+        return self.book_features.subscribe(exchange.name + '|' + symbol.upper(), conflation, latest)
+
+    def book_analytics(self, exchange_name, symbol):
+        """
+        Latest BookFeatures of a book, None before it is live
+        """
+        analytics = self.analytics.get(exchange_name + '|' + symbol.upper())
+        return analytics.features if analytics is not None else None
+
+    def subscribe_top_of_book(self, exchange, symbol, conflation=None, latest=False):
+        """
+        Subscription yielding TopOfBook events for exchange|symbol, optionally conflated to one per interval
+        """
+        return self.top_of_book.subscribe(exchange.name + '|' + symbol.upper(), conflation, latest)
 
     async def get_open_orders(self):
         while True:
@@ -71,136 +319,319 @@ class MasterDatafeed:
 
             self.open_orders, self.open_positions = order_message_handler(self.open_orders, self.open_positions,
                                                                           msg)
+            ob_id = msg.exchange + '|' + msg.symbol
+            if self.order_events.has_subscribers(ob_id):
+                self.order_events.publish(ob_id, msg)
+            if msg.executionType == 'TRADE':
+                fill = self.open_positions[-1]
+                scale = self.exchanges[fill.exchange].get_scale(fill.symbol)
+                self.positions.on_fill(fill.exchange, fill.symbol, fill.side, scale.qty_to_float(fill.fill_quantity),
+                                       scale.price_to_float(fill.avg_fill_price), msg.isMaker,
+                                       msg.transactTime / 1000 if msg.transactTime else None)
+                if self.fill_events.has_subscribers(ob_id):
+                    self.fill_events.publish(ob_id, fill)
 
     async def get_balance(self, exchange):
-        self.balances[exchange.name] = {}
+        balances = self.balances[exchange.name] = Balances(exchange.name)
+        queue = self.balance_queues[exchange.name]
         while True:
-            msg = await self.balance_message_queue.get()
+            msg = await queue.get()
+            if msg.exchange is not None and msg.exchange != exchange.name:
+                print(f'{exchange.name} balance consumer got a {msg.exchange} message, dropped')
+                continue
+
+            changed = apply_balance_updates(balances, msg)
+            if msg.msgType == 'snapshot':
+                self.positions.load_balances(exchange.name, msg.balances, self.symbols)
+            if not changed:
+                continue
 
-            self.balances[exchange.name] = apply_balance_updates(self.balances[exchange.name], msg)
+            self.balance_history.extend(balance_rows(exchange.name, balances.event_time, changed))
+            if len(self.balance_history) - self.balance_history_stored >= self.balance_batch:
+                self.store_balances()
+                self.trim_balance_history()
+            if self.balance_events.has_subscribers(exchange.name):
+                self.balance_events.publish(exchange.name, BalanceMessage('update', balances.event_time, changed,
+                                                                         exchange.name))
 
             self.equity_tracking = True
             # lastTrade = self.open_positions[-1]
             # ts = lastTrade['transactTime']
 
-    async def get_single_orderbook(self, exchange, symbol):
-        ob_id = exchange.name + '|' + symbol
-        while self.ob_stream_active:
-            orderbook = self.order_books[ob_id]
-            print(orderbook)
-            await asyncio.sleep(1)
+    async def get_single_orderbook(self, exchange, symbol, conflation=1):
+        """
+        Prints the book after it changes, at most once per `conflation` seconds
+        """
+        async with self.subscribe_books(exchange, symbol, conflation=conflation, latest=True) as books:
+            async for orderbook in books:
+                print(orderbook)
 
     async def get_positions(self):
-        while self.open_positions:
-            print(self.open_positions)
-            await asyncio.sleep(5)
+        """
+        Prints every fill with the resulting positions / PnL
+        """
+        async with self.subscribe_fills(latest=True) as fills:
+            async for fill in fills:
+                print(fill)
+                print(self.positions.summary())
+
+    def subscribe(self, topic, key=ALL, conflation=None, latest=False):
+        """
+        Subscription to one topic of the event bus ('book', 'top_of_book', 'orders', 'fills', 'balances',
+        'book_features', 'consolidated', 'crossed_markets', 'trades', 'trade_stats', 'bars') for one key
+        (exchange|symbol; exchange name for balances; symbol for consolidated books) or ALL keys.
+        Subscribers are woken on publish; conflation (seconds) and latest=True keep slow consumers on the
+        latest state instead of a backlog. Use it as `async with ... as subscription` so it is removed when the
+        consumer exits or is cancelled.
+        """
+        return self.events.subscribe(topic, key, conflation, latest)
+
+    def subscribe_books(self, exchange, symbol, conflation=None, latest=True):
+        """
+        Subscription yielding the live OrderBook of exchange|symbol after every applied change. The book keeps
+        changing after delivery: read it before the next await.
+        """
+        return self.book_events.subscribe(exchange.name + '|' + symbol.upper(), conflation, latest)
+
+    def subscribe_orders(self, exchange=None, symbol=None, conflation=None, latest=False):
+        """
+        Subscription yielding ExecutionReports of exchange|symbol, of every book without exchange / symbol
+        """
+        key = ALL if exchange is None else exchange.name + '|' + symbol.upper()
+        return self.order_events.subscribe(key, conflation, latest)
+
+    def subscribe_fills(self, exchange=None, symbol=None, conflation=None, latest=False):
+        """
+        Subscription yielding fills (Position) of exchange|symbol, of every book without exchange / symbol
+        """
+        key = ALL if exchange is None else exchange.name + '|' + symbol.upper()
+        return self.fill_events.subscribe(key, conflation, latest)
 
     async def track_bba(self, freq, exchange, symbol, df_size):
-        msg_num = 0
-        file_num = 0
+        """
+        Records every top-of-book change, conflated to at most one sample per `freq` seconds (0: every change)
+        """
         ob_id = exchange.name + '|' + symbol
-
+        if ob_id not in self.BBA:
+            self.BBA[ob_id] = RingBuffer(df_size, BBA_COLUMNS)
+        bba = self.BBA[ob_id]
+
+        async with self.subscribe_top_of_book(exchange, symbol, conflation=freq, latest=True) as tobs:
+            async for tob in tobs:
+                if tob.bidPrice is None or tob.askPrice is None:
+                    continue
+                bba.append(tob.eventTime, tob.bidPrice, tob.askPrice, (tob.bidPrice + tob.askPrice) / 2,
+                           tob.bidQty, tob.askQty)
+
+                # hand the table to the background writer every N rows
+                if bba.pending() == df_size and self.storage is not None:
+                    self.storage.write(f'BBA/{exchange.name}/{symbol}', bba.export())
+
+    async def track_equity(self, exchange, freq=.1):
+        """
+        Marks positions to every book's mid price, conflated to at most one mark per `freq` seconds per book
+        """
+        async with asyncio.TaskGroup() as tg:
+            for symbol in exchange.symbols:
+                tg.create_task(self.track_marks(exchange, symbol.upper(), freq))
+
+    async def track_marks(self, exchange, symbol, freq):
+        async with self.subscribe_top_of_book(exchange, symbol, conflation=freq, latest=True) as tobs:
+            async for tob in tobs:
+                if tob.bidPrice is None or tob.askPrice is None:
+                    continue
+                self.positions.on_mark(exchange.name, symbol, (tob.bidPrice + tob.askPrice) / 2, tob.eventTime)
+
+    async def track_bars(self, exchange):
+        """
+        Resamples every book's top of book and trades into bars at bar_resolutions
+        """
+        async with asyncio.TaskGroup() as tg:
+            for symbol in exchange.symbols:
+                symbol = symbol.upper()
+                resampler = self.bars[exchange.name + '|' + symbol] = BarResampler(exchange.name, symbol,
+                                                                                   self.bar_resolutions)
+                tg.create_task(self.resample_quotes(exchange, symbol, resampler))
+                tg.create_task(self.resample_trades(exchange, symbol, resampler))
+                tg.create_task(self.close_bars(resampler))
+
+    async def resample_quotes(self, exchange, symbol, resampler):
+        async with self.subscribe_top_of_book(exchange, symbol) as tobs:
+            async for tob in tobs:
+                if tob.bidPrice is None or tob.askPrice is None:
+                    continue
+                self.publish_bars(resampler, resampler.on_quote(tob.eventTime, (tob.bidPrice + tob.askPrice) / 2))
+
+    async def resample_trades(self, exchange, symbol, resampler):
+        scale = exchange.get_scale(symbol)
+        async with self.subscribe_trades(exchange, symbol) as trades:
+            async for trade in trades:
+                self.publish_bars(resampler, resampler.on_trade(trade.tradeTime / 1000,
+                                                                scale.price_to_float(trade.price),
+                                                                scale.qty_to_float(trade.quantity),
+                                                                not trade.buyerIsMaker))
+
+    async def close_bars(self, resampler):
+        # completes bars of quiet books, at the finest resolution
+        interval = min(self.bar_resolutions)
         while True:
-            try:
-                ts = self.order_books[ob_id]['timestamp']
-                best_bid = float(self.order_books[ob_id]['message']['bids'][0][0])
-                best_ask = float(self.order_books[ob_id]['message']['asks'][0][0])
-                mid = (best_bid + best_ask) / 2
-
-                if msg_num == 0:
-                    self.BBA[ob_id] = {'timestamp': [ts], 'best_bid': [best_bid], 'best_ask': [best_ask],
-                                       'midprice': [mid]}
-
-                if 0 < msg_num < df_size:
-                    self.BBA[ob_id]['timestamp'].append(ts)
-                    self.BBA[ob_id]['best_bid'].append(best_bid)
-                    self.BBA[ob_id]['best_ask'].append(best_ask)
-                    self.BBA[ob_id]['midprice'].append(mid)
-
-                if msg_num >= df_size:
-                    # pop first row, append msg
-                    self.BBA[ob_id]['timestamp'].append(ts)
-                    self.BBA[ob_id]['best_bid'].append(best_bid)
-                    self.BBA[ob_id]['best_ask'].append(best_ask)
-                    self.BBA[ob_id]['midprice'].append(mid)
-
-                    self.BBA[ob_id]['timestamp'].pop(0)
-                    self.BBA[ob_id]['best_bid'].pop(0)
-                    self.BBA[ob_id]['best_ask'].pop(0)
-                    self.BBA[ob_id]['midprice'].pop(0)
-
-                    # store table to DB every N rows
-                    if msg_num % df_size == 0:
-                        df = pd.DataFrame(self.BBA[ob_id])
-                        df.to_parquet(f'C:/Users/Rob Cheresh/Desktop/Algo Trading/'
-                                      f'Datasets/HFT/BBA/BinanceUS/{symbol}{file_num}.parquet', engine='fastparquet')
-                        file_num += 1
-                msg_num += 1
-                await asyncio.sleep(freq)
-            except KeyError:
-                await asyncio.sleep(1)
-                continue
-
-    async def track_equity(self, exchange):
-
-        equity_value = []
-        assets_tracking = []
-        while self.equity_tracking:
-            try:
-                current_balances = self.balances[exchange.name]
-
-                for bal in current_balances['balances']:
-                    if float(bal[1]) == 0:
-                        continue
-
-                    if float(bal[1]) > 0 and bal[0] != 'USD':
-                        symbol = bal[0] + 'USD'
-                        quantity = float(bal[1])
-
-                        if symbol not in assets_tracking:
-                            update_time = current_balances['eventTime']
-                            bba_ts = self.BBA[exchange.name + '|' + symbol]['timestamp']
-                            bba_ts.reverse()
-
-                            for i, ts in enumerate(bba_ts):
-
-                                if update_time > ts:
-                                    continue
-
-                                if update_time <= ts:
-                                    print(f'found {i - 1}')
-                                    assets_tracking.append(symbol)
-                                    timestamps = self.BBA[exchange.name + '|' + symbol]['timestamp'][-i + 1:-1]
-                                    equity_value = list(
-                                        np.dot(self.BBA[exchange.name + '|' + symbol]['midprice'][-i + 1:-1],
-                                               quantity))
-                                    print(equity_value)
-                        else:
-                            equity_value.append(self.BBA[exchange.name + '|' + symbol]['midprice'][-1] * quantity)
-                            print(equity_value)
-            except KeyError:
-                await asyncio.sleep(1)
-                continue
-            await asyncio.sleep(.1)
+            await asyncio.sleep(interval)
+            now = resampler.exchange_time()
+            if now is not None:
+                self.publish_bars(resampler, resampler.flush(now - self.bar_delay))
+
+    def publish_bars(self, resampler, bars):
+        for bar in bars:
+            key = f'{bar.exchange}|{bar.symbol}|{bar.resolution}'
+            if self.bar_events.has_subscribers(key):
+                self.bar_events.publish(key, bar)
+            history = resampler.history(bar.resolution)
+            if self.storage is not None and history.pending() >= self.bar_batch:
+                self.store_bars(resampler, bar.resolution)
+
+    def store_bars(self, resampler, resolution):
+        self.storage.write(f'BARS/{resampler.exchange}/{resampler.symbol}/{resolution_label(resolution)}',
+                           resampler.history(resolution).export())
+
+    def subscribe_bars(self, exchange, symbol, resolution, conflation=None, latest=False):
+        """
+        Subscription yielding completed Bars of exchange|symbol at resolution (seconds)
+        """
+        return self.bar_events.subscribe(f'{exchange.name}|{symbol.upper()}|{resolution}', conflation, latest)
+
+    def store_balances(self):
+        """
+        Hands balance rows not yet persisted to the background writer, one stream per exchange
+        """
+        rows = self.balance_history[self.balance_history_stored:]
+        self.balance_history_stored = len(self.balance_history)
+        if not rows or self.storage is None:
+            return
+        batch = pd.DataFrame(rows, columns=BALANCE_COLUMNS)
+        for exchange_name, group in batch.groupby('exchange', sort=False):
+            self.storage.write(f'BALANCES/{exchange_name}', {column: group[column].to_numpy()
+                                                             for column in BALANCE_COLUMNS})
+
+    def trim_balance_history(self):
+        """
+        Drops persisted balance rows older than the oldest BBA sample still in memory, keeping the latest such
+        row per (exchange, asset) as the starting balance. Bounds the history by the BBA ring buffers.
+        """
+        cutoff = min((bba['timestamp'][0] for bba in self.BBA.values() if len(bba)), default=None)
+        stored = self.balance_history[:self.balance_history_stored]
+        pending = self.balance_history[self.balance_history_stored:]
+        start = {}
+        recent = []
+        for row in stored:
+            if cutoff is not None and row[0] >= cutoff:
+                recent.append(row)
+            else:
+                start[(row[1], row[2])] = row
+        trimmed = sorted(start.values(), key=lambda row: row[0]) + recent
+        self.balance_history = trimmed + pending
+        self.balance_history_stored = len(trimmed)
+
+    def equity_curve(self, freq=None, since=None):
+        """
+        NAV curve over the in-memory BBA ring buffers and balance history, see data_handling.equity_curve
+        """
+        mids = {}
+        for ob_id, bba in self.BBA.items():
+            exchange_name, symbol = ob_id.split('|')
+            mids[(exchange_name, symbol)] = (bba['timestamp'], bba['midprice'])
+        balances = pd.DataFrame(self.balance_history, columns=BALANCE_COLUMNS)
+        return equity_curve(balances, mids, freq=freq, since=since)
+
+    def start_feed_processes(self, exchange_factories, depth=20):
+        """
+        Moves market data handling into one process per exchange, {exchange name: factory(symbols)}. Books
+        are read back with read_book; call before ws_datafeed, which then runs only the user data streams
+        for these exchanges. In this mode the parent gets no book, top of book, analytics, consolidated,
+        trade or bar events (nor BBA / equity tracking) for them.
+        """
+        for name, exchange_factory in exchange_factories.items():
+            feed = FeedProcess(name, exchange_factory, self.symbols, depth).start()
+            self.feed_processes[feed.name] = feed
+            print(f'{feed.name} feed process started (pid {feed.process.pid})')
+
+    def read_book(self, exchange_name, symbol, n=None):
+        """
+        Consistent top-n BookLevels of a book maintained by a feed process
+        """
+        return self.feed_processes[exchange_name].segment.read(symbol, n)
+
+    async def market_datafeed(self):
+        """
+        Market data only: order books for every exchange, used inside feed processes
+        """
+        for exchange in self.exchange_list:
+            await exchange.warm_up()
+            await exchange.load_symbol_scales()
+        await self.initialize_queues()
+        async with asyncio.TaskGroup() as tg:
+            for exchange in self.exchange_list:
+                tg.create_task(exchange.marketdata_ws(ob_queue=self.orderbook_router))
+                tg.create_task(self.get_orderbooks(exchange))
 
     async def ws_datafeed(self):
         asyncio.ensure_future(self.get_open_orders())
+        if self.storage is not None:
+            self.storage.start()
         async with asyncio.TaskGroup() as tg:
+            tg.create_task(self.report_latency())
             for exchange in self.exchange_list:
-                tg.create_task(exchange.marketdata_ws(ob_queue=self.orderbook_update_queue))
                 tg.create_task(exchange.userdata_ws(order_queue=self.order_message_queue,
-                                                    balance_queue=self.balance_message_queue))
-                tg.create_task(self.get_orderbooks(exchange))
+                                                    balance_queue=self.balance_queues[exchange.name]))
                 tg.create_task(self.get_balance(exchange))
+                if exchange.name in self.feed_processes:
+                    # market data runs in the feed process (see start_feed_processes)
+                    continue
+                tg.create_task(exchange.marketdata_ws(ob_queue=self.orderbook_router))
+                tg.create_task(self.get_orderbooks(exchange))
+                tg.create_task(self.get_trades(exchange))
+                tg.create_task(self.track_bars(exchange))
                 tg.create_task(self.track_bba(.1, exchange, 'BTCUSD', 1000))
                 tg.create_task(self.track_equity(exchange))
 
+    async def close(self):
+        """
+        Flushes storage and recordings and closes every exchange's pooled connections. Called once by the
+        owner of the datafeed (main, or the feed process), later calls do nothing
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.storage is not None:
+            self.store_balances()
+            if self.store_trades:
+                for tape in self.trade_tapes.values():
+                    if tape.tape.pending():
+                        self.storage.write(f'TRADES/{tape.exchange}/{tape.symbol}', tape.export())
+            for resampler in self.bars.values():
+                for resolution in resampler.builders:
+                    if resampler.history(resolution).pending():
+                        self.store_bars(resampler, resolution)
+            self.storage.close()
+        for feed in self.feed_processes.values():
+            feed.stop()
+        self.feed_processes = {}
+        for exchange in self.exchange_list:
+            if exchange.recorder is not None:
+                exchange.recorder.close()
+            await exchange.close()
+
 
 async def main():
     master = MasterDatafeed(exchange_list=[binance_us(symbols=['BTCUSD', 'ETHUSD', 'ADAUSD'])],
-                            symbols=['BTCUSD', 'ETHUSD', 'ADAUSD'])
-    await master.initialize_datafeeds()
-    await master.ws_datafeed()
-
-
-asyncio.run(main())
+                            symbols=['BTCUSD', 'ETHUSD', 'ADAUSD'],
+                            data_dir='Datasets/HFT',
+                            store_trades=True)
+    try:
+        await master.initialize_datafeeds()
+        await master.ws_datafeed()
+    finally:
+        await master.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,78 +1,208 @@
-def snapshot_message(symbol=None, last_update_id=None, bids=None, asks=None):
-    msg = {'symbol': symbol,
-           'lastUpdateId': last_update_id,
-           'bids': bids,
-           'asks': asks,
-           }
-    return msg
-
-
-def orderbook_message(last_update_id=None, bids=None, asks=None):
-    msg = {'lastUpdateId': last_update_id,
-           'bids': bids,
-           'asks': asks,
-           }
-    return msg
-
-
-def orderbook_update(symbol=None, event_time=None,
-                     first_update_id=None, last_update_id=None, bids=None, asks=None):
-    msg = {'symbol': symbol,
-           'eventTime': event_time,
-           'firstUpdateId': first_update_id,
-           'lastUpdateId': last_update_id,
-           'bids': bids,
-           'asks': asks
-           }
-    return msg
-
-
-def account_update_msg(eventTime=None, balances=None):
-    msg = {
-           'eventTime': eventTime,
-           'balances': balances
-           }
-    return msg
-
-
-def order_update_msg(exchange=None, symbol=None, eventTime=None, side=None, quantity=None, price=None,
-                     cu_fill_quant=None,cu_quote_quant=None,clientOrderID=None,
-                     transactTime=None, executionType=None, orderType=None, tif=None,
-                     origClientOrderID=None, rejectReason=None):
-    msg = {'exchange': exchange,
-           'symbol': symbol,
-           'eventTime': eventTime,
-           'executionType': executionType,
-           'orderType': orderType,
-           'side': side,
-           'order_quantity': quantity,
-           'order_price': price,
-           'fill_quantity': cu_fill_quant,
-           'fill_quote_quant': cu_quote_quant,
-           'clientOrderID': clientOrderID,
-           'transactTime': transactTime,
-           'tif': tif,
-           'origClientOrderID': origClientOrderID,
-           'rejectReason': rejectReason
-           }
-    return msg
-
-
-def account_snapshot_msg(updateTime=None, makerFee=None, takerFee=None, balances=None):
-    msg = {'updateTime': updateTime,
-           'makerFee': makerFee,
-           'takerFee': takerFee,
-           'balances': balances
-           }
-    return msg
+from collections import namedtuple
+
+
+class MessageView:
+    """
+    Read-only mapping view over a record's fields, so msg['eventTime'] keeps working alongside msg.eventTime
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key in self._fields:
+                return getattr(self, key)
+            raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def get(self, key, default=None):
+        if key in self._fields:
+            return getattr(self, key)
+        return default
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return tuple(self)
+
+    def items(self):
+        return zip(self._fields, self)
+
+    def as_dict(self):
+        return dict(zip(self._fields, self))
+
+
+# envelopes
+
+class BookMessage(MessageView, namedtuple('BookMessage', ['messageType', 'message', 'timestamp', 'symbol',
+                                                            'exchange', 'recvTime', 'decodeTime'],
+                                           defaults=(None, None))):
+    """
+    Order book queue envelope, messageType is 'orderbook_snapshot' or 'orderbook_update'.
+    timestamp is the queue put time; recvTime / decodeTime are the socket receive and decode times
+    (seconds) for latency tracking.
+    """
+    __slots__ = ()
+
+
+class BalanceMessage(MessageView, namedtuple('BalanceMessage', ['msgType', 'eventTime', 'balances', 'exchange'],
+                                              defaults=(None,))):
+    """
+    Balance queue envelope, msgType is 'snapshot' or 'update', exchange the account's exchange name
+    """
+    __slots__ = ()
+
+
+# market data
+
+class SnapshotMessage(MessageView, namedtuple('SnapshotMessage', ['symbol', 'lastUpdateId', 'bids', 'asks'])):
+    """
+    Order book snapshot, levels are [(price ticks, quantity lots), ...] once decoded at ingest
+    """
+    __slots__ = ()
+
+
+class DepthUpdate(MessageView, namedtuple('DepthUpdate', ['symbol', 'eventTime', 'firstUpdateId', 'lastUpdateId',
+                                                          'bids', 'asks'])):
+    """
+    Order book diff, built directly from the decoded websocket frame.
+    Levels are [(price ticks, quantity lots), ...] in the symbol's fixed-point scale.
+    """
+    __slots__ = ()
+
+
+class TradeUpdate(MessageView, namedtuple('TradeUpdate', ['symbol', 'eventTime', 'tradeId', 'price', 'quantity',
+                                                          'tradeTime', 'buyerIsMaker'])):
+    """
+    Public trade, price / quantity in the symbol's fixed-point scale
+    """
+    __slots__ = ()
+
+
+class TradeStats(MessageView, namedtuple('TradeStats', ['exchange', 'symbol', 'eventTime', 'window', 'count',
+                                                        'volume', 'buyVolume', 'sellVolume', 'vwap',
+                                                        'imbalance'])):
+    """
+    Trade tape aggregates over the last `window` seconds (see trades.TradeTape), floats. Buy volume is taker
+    (aggressor) buys, imbalance is (buy - sell) / (buy + sell) volume, vwap None without trades.
+    """
+    __slots__ = ()
+
+
+class Bar(MessageView, namedtuple('Bar', ['exchange', 'symbol', 'resolution', 'startTime', 'open', 'high', 'low',
+                                          'close', 'volume', 'buyVolume', 'trades', 'vwap', 'quotes'])):
+    """
+    Completed time bar (see bars.BarResampler), floats: resolution and startTime in seconds, open / high /
+    low / close of the mid (None before the first quote), trade volume, taker buy volume, trade count, VWAP
+    (None without trades) and the number of top of book changes
+    """
+    __slots__ = ()
+
+
+class TopOfBook(MessageView, namedtuple('TopOfBook', ['exchange', 'symbol', 'eventTime', 'timestamp',
+                                                      'bidPrice', 'bidQty', 'askPrice', 'askQty'])):
+    """
+    Best bid / ask change event. eventTime is the exchange time of the change and timestamp the local
+    receive time, both in seconds; prices / sizes are floats, None for an empty side.
+    """
+    __slots__ = ()
+
+
+class BookFeatures(MessageView, namedtuple('BookFeatures', ['exchange', 'symbol', 'eventTime', 'mid', 'spread',
+                                                            'spreadBps', 'microprice', 'imbalance', 'bidDepth',
+                                                            'askDepth', 'buyFillPrice', 'sellFillPrice'])):
+    """
+    Book analytics snapshot (see analytics.BookAnalytics), floats. imbalance is (bid - ask) / (bid + ask) size
+    over the top levels, bidDepth / askDepth the size within the depth band around mid and
+    buyFillPrice / sellFillPrice the average price of a market order of the configured notional
+    (None when the book is too thin).
+    """
+    __slots__ = ()
+
+
+class ConsolidatedTop(MessageView, namedtuple('ConsolidatedTop', ['symbol', 'eventTime', 'bidExchange', 'bidPrice',
+                                                                  'bidQty', 'bidNetPrice', 'askExchange', 'askPrice',
+                                                                  'askQty', 'askNetPrice', 'spreadBps',
+                                                                  'netSpreadBps'])):
+    """
+    Best bid / ask across exchanges (see consolidated.ConsolidatedBook), floats. Net prices include the
+    venue's fee: what a sell at the bid receives / a buy at the ask pays per unit. None for an empty side.
+    """
+    __slots__ = ()
+
+
+class CrossedMarket(MessageView, namedtuple('CrossedMarket', ['symbol', 'eventTime', 'buyExchange', 'buyPrice',
+                                                              'sellExchange', 'sellPrice', 'quantity', 'grossBps',
+                                                              'netBps'])):
+    """
+    One exchange's bid above another's ask: buy at buyPrice on buyExchange, sell at sellPrice on sellExchange.
+    quantity is the size crossing after fees over the consolidated levels, netBps the top level edge after fees.
+    """
+    __slots__ = ()
+
+
+class BookLevels(MessageView, namedtuple('BookLevels', ['exchange', 'symbol', 'state', 'lastUpdateId', 'timestamp',
+                                                        'bids', 'asks'])):
+    """
+    Consistent top-N book read from shared memory (see sharedbook), bids / asks are float arrays of
+    [price, quantity] rows from best to worst
+    """
+    __slots__ = ()
+
+
+# user data
+
+class ExecutionReport(MessageView, namedtuple('ExecutionReport', ['exchange', 'symbol', 'eventTime', 'side',
+                                                                  'order_quantity', 'order_price', 'fill_quantity',
+                                                                  'fill_quote_quant', 'clientOrderID',
+                                                                  'transactTime', 'executionType', 'orderType',
+                                                                  'tif', 'origClientOrderID', 'rejectReason',
+                                                                  'orderStatus', 'last_fill_quantity',
+                                                                  'last_fill_price', 'commission', 'commissionAsset',
+                                                                  'isMaker'],
+                                           defaults=(None, None, None, None, None, None))):
+    """
+    Order update. order_price / last_fill_price are in price ticks, order_quantity / fill_quantity /
+    last_fill_quantity in quantity lots and fill_quote_quant in quote units (price + quantity decimals) of the
+    symbol's fixed-point scale. fill_* are cumulative, last_fill_* the fill of this report;
+    commission is a float in commissionAsset.
+    """
+    __slots__ = ()
+
+
+class AccountUpdate(MessageView, namedtuple('AccountUpdate', ['eventTime', 'balances'])):
+    __slots__ = ()
+
+
+class AccountSnapshot(MessageView, namedtuple('AccountSnapshot', ['updateTime', 'makerFee', 'takerFee',
+                                                                  'balances'])):
+    __slots__ = ()
+
+
+class Balance(MessageView, namedtuple('Balance', ['asset', 'free', 'locked'])):
+    __slots__ = ()
+
+    @property
+    def total(self):
+        return self.free + self.locked
+
+
+class Position(MessageView, namedtuple('Position', ['exchange', 'symbol', 'side', 'fill_quantity',
+                                                    'avg_fill_price', 'transactTime'])):
+    __slots__ = ()
 
 
 def position_msg(msg, exchange):
-    message = {'exchange': exchange,
-               'symbol': msg['symbol'],
-               'side': msg['side'],
-               'fill_quantity': float(msg['fill_quantity']),
-               'avg_fill_price': float(msg['fill_quote_quant'])/float(msg['fill_quantity']),
-               'transactTime': msg['transactTime']
-               }
-    return message
+    # fixed-point: quote (price + qty decimals) / quantity (qty decimals) -> price ticks
+    return Position(exchange, msg.symbol, msg.side, msg.fill_quantity,
+                    (msg.fill_quote_quant + msg.fill_quantity // 2) // msg.fill_quantity,
+                    msg.transactTime)
+
+
+def fill_msg(msg, exchange):
+    # single fill of a (partially) filled order, price already in ticks
+    return Position(exchange, msg.symbol, msg.side, msg.last_fill_quantity, msg.last_fill_price,
+                    msg.transactTime)
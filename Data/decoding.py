@@ -0,0 +1,50 @@
+import json
+
+# optional fast JSON backends, stdlib json is always available as fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def available_backends():
+    """
+    Installed JSON backends, fastest first
+    """
+    backends = []
+    if orjson is not None:
+        backends.append('orjson')
+    if msgspec is not None:
+        backends.append('msgspec')
+    backends.append('json')
+    return backends
+
+
+def get_decoder(backend=None):
+    """
+    Returns (backend name, loads function) for the given backend, or the fastest installed one if None.
+    All loads functions accept str or bytes frames.
+    """
+    if backend is None:
+        backend = available_backends()[0]
+
+    if backend == 'orjson':
+        if orjson is None:
+            raise ImportError('orjson backend requested but orjson is not installed')
+        return backend, orjson.loads
+
+    if backend == 'msgspec':
+        if msgspec is None:
+            raise ImportError('msgspec backend requested but msgspec is not installed')
+        # reuse one decoder instance, avoids per-call setup
+        return backend, msgspec.json.Decoder().decode
+
+    if backend == 'json':
+        return backend, json.loads
+
+    raise ValueError(f'Unknown JSON backend: {backend}')
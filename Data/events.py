@@ -0,0 +1,155 @@
+import asyncio
+from typing import Dict, List
+
+# subscription key receiving the events of every key of a stream
+ALL = '*'
+
+
+class Subscription:
+    """
+    Queue-backed event subscriber, usable with `async for event in subscription`.
+    With a conflation interval (seconds) events are coalesced: the first event after a quiet period is
+    delivered immediately, later ones within the interval only as the latest value at the end of it.
+    With latest=True at most one event waits in the queue: a consumer that falls behind gets only the most
+    recent state instead of a backlog, `dropped` counts the events it skipped.
+    Use `async with stream.subscribe(...) as subscription` (or aclose()) so the subscription is removed
+    from its stream when the consumer exits or is cancelled.
+    """
+
+    def __init__(self, conflation=None, latest=False):
+        self.queue = asyncio.Queue()
+        self.conflation = conflation
+        self.latest = latest
+        self.dropped = 0
+        self._pending = None
+        self._flush_handle = None
+        self._last_sent = float('-inf')
+        # set by EventStream.subscribe
+        self._stream = None
+        self._key = None
+
+    def _deliver(self, event):
+        queue = self.queue
+        if self.latest and queue.qsize():
+            queue.get_nowait()
+            self.dropped += 1
+        queue.put_nowait(event)
+
+    def publish(self, event):
+        if not self.conflation:
+            self._deliver(event)
+            return
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._flush_handle is None and now - self._last_sent >= self.conflation:
+            self._last_sent = now
+            self._deliver(event)
+        else:
+            self._pending = event
+            if self._flush_handle is None:
+                self._flush_handle = loop.call_at(self._last_sent + self.conflation, self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        self._last_sent = asyncio.get_running_loop().time()
+        event, self._pending = self._pending, None
+        self._deliver(event)
+
+    def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+    async def aclose(self):
+        """
+        Unsubscribes from the stream, pending events are discarded
+        """
+        if self._stream is not None:
+            self._stream.unsubscribe(self._key, self)
+            self._stream = None
+        else:
+            self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def get(self):
+        return await self.queue.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+
+class EventStream:
+    """
+    Keyed fan-out of events (e.g. per exchange|symbol) to subscriptions, subscribers of ALL get every key's
+    events (conflated / latest-only across keys)
+    """
+
+    def __init__(self):
+        self.subscribers: Dict[str, List[Subscription]] = {}
+
+    def subscribe(self, key=ALL, conflation=None, latest=False):
+        subscription = Subscription(conflation, latest)
+        subscription._stream = self
+        subscription._key = key
+        self.subscribers.setdefault(key, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, key, subscription):
+        subscription.close()
+        subscribers = self.subscribers.get(key)
+        if subscribers and subscription in subscribers:
+            subscribers.remove(subscription)
+            if not subscribers:
+                del self.subscribers[key]
+
+    def has_subscribers(self, key):
+        subscribers = self.subscribers
+        return bool(subscribers.get(key)) or bool(subscribers.get(ALL))
+
+    def publish(self, key, event):
+        for subscription in self.subscribers.get(key, ()):
+            subscription.publish(event)
+        if key != ALL:
+            for subscription in self.subscribers.get(ALL, ()):
+                subscription.publish(event)
+
+
+class EventBus:
+    """
+    Named EventStreams (topics such as 'book', 'top_of_book', 'orders', 'fills', 'balances'), so producers
+    publish and consumers subscribe through one surface and are woken as soon as an event is published
+    """
+
+    def __init__(self, topics=()):
+        self.topics: Dict[str, EventStream] = {}
+        for name in topics:
+            self.topic(name)
+
+    def topic(self, name):
+        stream = self.topics.get(name)
+        if stream is None:
+            stream = self.topics[name] = EventStream()
+        return stream
+
+    def subscribe(self, topic, key=ALL, conflation=None, latest=False):
+        if topic not in self.topics:
+            raise KeyError(f'Unknown event topic {topic}, one of {", ".join(self.topics)}')
+        return self.topics[topic].subscribe(key, conflation, latest)
+
+    def unsubscribe(self, topic, key, subscription):
+        self.topics[topic].unsubscribe(key, subscription)
+
+    def has_subscribers(self, topic, key):
+        return self.topics[topic].has_subscribers(key)
+
+    def publish(self, topic, key, event):
+        self.topics[topic].publish(key, event)
@@ -1,6 +1,6 @@
 from marketdata import ExchangeDataSource
-from datatypes import snapshot_message, orderbook_update, account_update_msg, \
-    order_update_msg, account_snapshot_msg, position_msg
+from datatypes import SnapshotMessage, DepthUpdate, TradeUpdate, ExecutionReport, AccountUpdate, AccountSnapshot
+from fixedpoint import SymbolScale
 import hmac
 import time
 import base64
@@ -13,31 +13,53 @@ import json
 
 def binance_us(symbols):
     def get_ob_update(msg):
-        update_msg = orderbook_update(msg.get('s'), msg.get('E'),
-                                      msg.get('U'), msg.get('u'),
-                                      msg.get('b'), msg.get('a'))
+        scale = exchange.get_scale(msg.get('s'))
+        update_msg = DepthUpdate(msg.get('s'), msg.get('E'),
+                                 msg.get('U'), msg.get('u'),
+                                 scale.decode_levels(msg.get('b')), scale.decode_levels(msg.get('a')))
         return update_msg
 
+    def get_trade(msg):
+        scale = exchange.get_scale(msg.get('s'))
+        trade_msg = TradeUpdate(msg.get('s'), msg.get('E'), msg.get('t'),
+                                scale.price_to_int(msg.get('p')), scale.qty_to_int(msg.get('q')),
+                                msg.get('T'), msg.get('m'))
+        return trade_msg
+
     def get_ob_snapshot(msg):
-        snapshot_msg = snapshot_message(msg.get('s'), msg.get('lastUpdateId'),
-                                        msg.get('bids'), msg.get('asks'))
+        snapshot_msg = SnapshotMessage(msg.get('s'), msg.get('lastUpdateId'),
+                                       msg.get('bids'), msg.get('asks'))
         return snapshot_msg
 
     def get_acct_snapshot(msg):
-        snapshot_msg = account_snapshot_msg(msg.get('updateTime'), msg.get('commissionRates').get('maker'),
-                                            msg.get('commissionRates').get('taker'), msg.get('balances'))
+        snapshot_msg = AccountSnapshot(msg.get('updateTime'), msg.get('commissionRates').get('maker'),
+                                       msg.get('commissionRates').get('taker'), msg.get('balances'))
         return snapshot_msg
 
     def get_order_update(msg):
-        order_msg = order_update_msg('BinanceUS', msg.get('s'), msg.get('E'), msg.get('S'), msg.get('q'), msg.get('p'),
-                                     msg.get('z'), msg.get('Z'), msg.get('c'), msg.get('T'), msg.get('x'), msg.get('o'),
-                                     msg.get('f'), msg.get('C'), msg.get('r'))
+        scale = exchange.get_scale(msg.get('s'))
+        order_msg = ExecutionReport('BinanceUS', msg.get('s'), msg.get('E'), msg.get('S'),
+                                    scale.qty_to_int(msg.get('q')), scale.price_to_int(msg.get('p')),
+                                    scale.qty_to_int(msg.get('z')), scale.quote_to_int(msg.get('Z')),
+                                    msg.get('c'), msg.get('T'), msg.get('x'), msg.get('o'),
+                                    msg.get('f'), msg.get('C'), msg.get('r'), msg.get('X'),
+                                    scale.qty_to_int(msg.get('l')), scale.price_to_int(msg.get('L')),
+                                    float(msg.get('n') or 0), msg.get('N'), msg.get('m'))
         return order_msg
 
     def get_account_update(msg):
-        account_msg = account_update_msg(msg.get('E'), msg.get('B'))
+        account_msg = AccountUpdate(msg.get('E'), msg.get('B'))
         return account_msg
 
+    def get_symbol_scales(msg):
+        scales = {}
+        for info in msg.get('symbols'):
+            filters = {f.get('filterType'): f for f in info.get('filters')}
+            scales[info.get('symbol')] = SymbolScale.from_steps(info.get('symbol'),
+                                                                filters['PRICE_FILTER'].get('tickSize'),
+                                                                filters['LOT_SIZE'].get('stepSize'))
+        return scales
+
     def create_signature(data, secret):
         postdata = urllib.parse.urlencode(data)
         message = postdata.encode()
@@ -57,12 +79,20 @@ def binance_us(symbols):
         }
         return params, headers
 
+    def subscribe_payloads(symbols):
+        return [{"method": "SUBSCRIBE", "params": [f"{symbol.lower()}@trade" for symbol in symbols], "id": 1},
+                {"method": "SUBSCRIBE", "params": [f"{symbol.lower()}@depth@100ms" for symbol in symbols], "id": 2}]
+
     exchange = ExchangeDataSource(ws_url='wss://stream.binance.us:9443/ws',
                                   ws_url_private='wss://stream.binance.us:9443/ws/',
                                   rest_url='https://api.binance.us/api/v3/',
                                   rest_depth_endpoint=f'depth?symbol={{}}',
                                   rest_userData_endpoint='userDataStream',
+                                  rest_ping_endpoint='ping',
                                   account_snapshot_endpoint='account',
+                                  exchange_info_endpoint='exchangeInfo?symbols=' + urllib.parse.quote(
+                                      json.dumps([symbol.upper() for symbol in symbols], separators=(',', ':'))),
+                                  symbol_scales_msg=get_symbol_scales,
                                   api_key='',
                                   api_secret='',
                                   user_snapshot_params=user_data_params,
@@ -85,6 +115,7 @@ def binance_us(symbols):
                                   ob_update=['s', 'E', 'U', 'u', 'b', 'a'],
                                   modify_snapshot_msg=get_ob_snapshot,
                                   modify_update_msg=get_ob_update,
+                                  modify_trade_msg=get_trade,
 
                                   channel_key_column='e',
                                   event_key_column='s',
@@ -100,28 +131,27 @@ def binance_us(symbols):
                                   # update, bids, asks
                                   snapshot_in_ws=False,
                                   ping_msg=None,
+                                  subscribe_payloads=subscribe_payloads,
+                                  # exchange limit is 1024 streams per connection
+                                  streams_per_connection=200,
+                                  streams_per_symbol=2,
                                   symbols=symbols,
                                   name='BinanceUS')
-    trade_params = []
-    depth_params = []
-    for symbol in exchange.symbols:
-        trade_params.append(f"{symbol.lower()}@trade")
-        depth_params.append(f"{symbol.lower()}@depth@100ms")
-    exchange.trade_payload['params'] = trade_params
-    exchange.depth_payload['params'] = depth_params
+    exchange.trade_payload, exchange.depth_payload = subscribe_payloads(exchange.symbols)
     return exchange
 
 
 def gemini():
     def get_ob_update(msg):
-        update_msg = orderbook_update(msg.get('s'), msg.get('E'),
-                                      msg.get('U'), msg.get('u'),
-                                      msg.get('b'), msg.get('a'))
+        scale = exchange.get_scale(msg.get('s'))
+        update_msg = DepthUpdate(msg.get('s'), msg.get('E'),
+                                 msg.get('U'), msg.get('u'),
+                                 scale.decode_levels(msg.get('b')), scale.decode_levels(msg.get('a')))
         return update_msg
 
     def get_ob_snapshot(msg):
-        snapshot_msg = snapshot_message(msg.get('s'), msg.get('lastUpdateId'),
-                                        msg.get('bids'), msg.get('asks'))
+        snapshot_msg = SnapshotMessage(msg.get('s'), msg.get('lastUpdateId'),
+                                       msg.get('bids'), msg.get('asks'))
         return snapshot_msg
 
     exchange = ExchangeDataSource(ws_url='wss://api.gemini.com/v2/marketdata',
@@ -0,0 +1,91 @@
+from decimal import Decimal
+
+# exchanges send prices / quantities as strings with at most this many decimals (Binance: 8)
+DEFAULT_DECIMALS = 8
+
+
+def step_decimals(step):
+    """
+    Number of decimals implied by a tick / lot size string, e.g. '0.01000000' -> 2. A zero step (filter
+    disabled) or a missing one is treated as unset: DEFAULT_DECIMALS
+    """
+    step = Decimal(step).normalize() if step is not None else None
+    if not step:
+        return DEFAULT_DECIMALS
+    return max(0, -step.as_tuple().exponent)
+
+
+def parse_fixed(value, decimals):
+    """
+    Parses a decimal string into an integer scaled by 10 ** decimals without going through float.
+    Digits beyond the scale are truncated (exchanges pad prices with zeros past the tick size).
+    """
+    if not isinstance(value, str):
+        return int(Decimal(str(value)).scaleb(decimals))
+    whole, _, frac = value.partition('.')
+    if len(frac) > decimals:
+        frac = frac[:decimals]
+    return int(whole + frac.ljust(decimals, '0'))
+
+
+class SymbolScale:
+    """
+    Per-symbol fixed-point representation: prices in ticks of 10 ** -price_decimals and
+    quantities in lots of 10 ** -qty_decimals. Quote quantities (price * quantity) use
+    price_decimals + qty_decimals so fills divide back into exact price ticks.
+    """
+    __slots__ = ('symbol', 'price_decimals', 'qty_decimals', 'quote_decimals',
+                 'price_factor', 'qty_factor', 'quote_factor')
+
+    def __init__(self, symbol, price_decimals=DEFAULT_DECIMALS, qty_decimals=DEFAULT_DECIMALS):
+        self.symbol = symbol
+        self.price_decimals = price_decimals
+        self.qty_decimals = qty_decimals
+        self.quote_decimals = price_decimals + qty_decimals
+        self.price_factor = 10 ** price_decimals
+        self.qty_factor = 10 ** qty_decimals
+        self.quote_factor = 10 ** self.quote_decimals
+
+    @classmethod
+    def from_steps(cls, symbol, tick_size, step_size):
+        return cls(symbol, step_decimals(tick_size), step_decimals(step_size))
+
+    # ingest: exchange strings -> integers
+
+    def price_to_int(self, value):
+        return parse_fixed(value, self.price_decimals)
+
+    def qty_to_int(self, value):
+        return parse_fixed(value, self.qty_decimals)
+
+    def quote_to_int(self, value):
+        return parse_fixed(value, self.quote_decimals)
+
+    def decode_levels(self, levels):
+        """
+        [[price, quantity], ...] strings -> [(price ticks, quantity lots), ...]
+        """
+        price_decimals = self.price_decimals
+        qty_decimals = self.qty_decimals
+        return [(parse_fixed(price, price_decimals), parse_fixed(quantity, qty_decimals))
+                for price, quantity in levels]
+
+    # edges: integers -> float / Decimal
+
+    def price_to_float(self, price):
+        return price / self.price_factor
+
+    def qty_to_float(self, quantity):
+        return quantity / self.qty_factor
+
+    def quote_to_float(self, quote):
+        return quote / self.quote_factor
+
+    def price_to_decimal(self, price):
+        return Decimal(price).scaleb(-self.price_decimals)
+
+    def qty_to_decimal(self, quantity):
+        return Decimal(quantity).scaleb(-self.qty_decimals)
+
+    def level_to_float(self, level):
+        return [level[0] / self.price_factor, level[1] / self.qty_factor]
@@ -1,9 +1,12 @@
 import websockets
 import json
+from decoding import get_decoder
 import asyncio
 import aiohttp
 from typing import Deque, Dict, List, Optional, Tuple
-from datatypes import position_msg
+from datatypes import BookMessage, BalanceMessage
+from fixedpoint import SymbolScale
+from recorder import MARKET_WS, BOOK_SNAPSHOT, USER_WS, ACCOUNT_SNAPSHOT, EXCHANGE_INFO
 import time
 
 
@@ -37,7 +40,22 @@ class ExchangeDataSource:
                  account_snapshot_msg,
                  user_snapshot_params,
                  account_snapshot_endpoint,
-                 user_ws_method
+                 user_ws_method,
+                 exchange_info_endpoint=None,
+                 symbol_scales_msg=None,
+                 modify_trade_msg=None,
+                 json_backend=None,
+                 recorder=None,
+                 rest_ping_endpoint=None,
+                 http_limit=100,
+                 http_limit_per_host=20,
+                 http_keepalive=60,
+                 http_dns_ttl=300,
+                 http_timeout=10,
+                 warmup_connections=2,
+                 subscribe_payloads=None,
+                 streams_per_connection=None,
+                 streams_per_symbol=2
                  ):
 
         self.trade_payload = trade_payload
@@ -50,8 +68,28 @@ class ExchangeDataSource:
         self.channel_keys = channel_keys
         self.modify_update_msg = modify_update_msg
         self.modify_snapshot_msg = modify_snapshot_msg
+        self.modify_trade_msg = modify_trade_msg
+        self.json_backend, self.loads = get_decoder(json_backend)
+        # optional FeedRecorder, raw frames / REST payloads are appended before decoding
+        self.recorder = recorder
+        # pooled keep-alive REST session, see http_session()
+        self._http_session: Optional[aiohttp.ClientSession] = None
+        self.rest_ping_endpoint = rest_ping_endpoint
+        self.http_limit = http_limit
+        self.http_limit_per_host = http_limit_per_host
+        self.http_keepalive = http_keepalive
+        self.http_dns_ttl = http_dns_ttl
+        self.http_timeout = aiohttp.ClientTimeout(total=http_timeout)
+        self.warmup_connections = warmup_connections
+        # market data sharding: subscribe_payloads(symbols) builds the subscribe messages for one connection
+        self.subscribe_payloads = subscribe_payloads
+        self.streams_per_connection = streams_per_connection
+        self.streams_per_symbol = streams_per_symbol
         self.event_keys = event_keys
         self.account_snapshot_endpoint = account_snapshot_endpoint
+        self.exchange_info_endpoint = exchange_info_endpoint
+        self.symbol_scales_msg = symbol_scales_msg
+        self.scales: Dict[str, SymbolScale] = {}
         self.ob_message = ob_message
         self.ob_update = ob_update
         self.user_ws_method = user_ws_method
@@ -68,7 +106,8 @@ class ExchangeDataSource:
         self.rest_userData_endpoint = rest_userData_endpoint
         self.symbols = symbols
         self.depth_queue = asyncio.Queue()
-        self.trade_queue = asyncio.Queue()
+        # decoded TradeUpdates are queued here once a consumer sets a queue (see MasterDatafeed.get_trades)
+        self.trade_queue = None
         self.balance_queue = asyncio.Queue()
         self.name = name
         self.is_on = False
@@ -95,175 +134,289 @@ class ExchangeDataSource:
         update_msg = self.modify_update_msg(msg)
         return update_msg
 
-    def process_ob_snapshot(self, msg):
+    def process_ob_snapshot(self, msg, symbol=None):
         update_msg = self.modify_snapshot_msg(msg)
-        return update_msg
+        return self.decode_book_msg(update_msg, symbol)
+
+    def http_session(self):
+        """
+        Long-lived session shared by every REST call (keep-alive pool with DNS caching), created on first use
+        so it binds to the running event loop
+        """
+        if self._http_session is None or self._http_session.closed:
+            connector = aiohttp.TCPConnector(limit=self.http_limit, limit_per_host=self.http_limit_per_host,
+                                             ttl_dns_cache=self.http_dns_ttl, keepalive_timeout=self.http_keepalive)
+            self._http_session = aiohttp.ClientSession(connector=connector)
+        return self._http_session
+
+    async def warm_up(self):
+        """
+        Opens warmup_connections pooled connections (DNS, TCP and TLS) before the first snapshot is needed
+        """
+        session = self.http_session()
+        url = self.rest_url + (self.rest_ping_endpoint or '')
+
+        async def ping():
+            async with session.get(url, timeout=self.http_timeout) as resp:
+                await resp.read()
+
+        start = time.perf_counter()
+        # concurrent requests so each one opens its own connection
+        results = await asyncio.gather(*(ping() for _ in range(self.warmup_connections)), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            print(f'|{self.name}| HTTP warm-up failed for {len(errors)}/{len(results)} connections: {errors[0]!r}')
+        else:
+            print(f'|{self.name}| HTTP pool warmed up, {len(results)} connections in '
+                  f'{(time.perf_counter() - start) * 1000:.1f}ms')
+
+    async def close(self):
+        """
+        Closes the user data websocket and the pooled REST session
+        """
+        if self.ws_session is not None and not self.ws_session.closed:
+            await self.ws_session.close()
+        if self._http_session is not None and not self._http_session.closed:
+            await self._http_session.close()
+        self._http_session = None
+
+    def get_scale(self, symbol):
+        symbol = symbol.upper()
+        scale = self.scales.get(symbol)
+        if scale is None:
+            scale = self.scales[symbol] = SymbolScale(symbol)
+        return scale
+
+    def decode_book_msg(self, book_msg, symbol=None):
+        """
+        Converts snapshot levels from exchange strings to fixed-point integers, once at ingest.
+        Updates, trades and execution reports are decoded by the exchange's typed message builders.
+        """
+        symbol = (symbol or book_msg.symbol).upper()
+        scale = self.get_scale(symbol)
+        return book_msg._replace(symbol=symbol, bids=scale.decode_levels(book_msg.bids),
+                                 asks=scale.decode_levels(book_msg.asks))
+
+    async def load_symbol_scales(self):
+        """
+        Loads tick / lot sizes for all symbols, symbols without exchange info keep the default 8 decimal scale
+        """
+        if self.exchange_info_endpoint is None or self.symbol_scales_msg is None:
+            return
+        async with self.http_session().get(self.rest_url + self.exchange_info_endpoint,
+                                           timeout=self.http_timeout) as resp:
+            raw = await resp.read()
+        if self.recorder is not None:
+            self.recorder.record(EXCHANGE_INFO, time.time(), raw)
+        self.apply_symbol_scales(raw)
+
+    def apply_symbol_scales(self, raw):
+        for symbol, scale in self.symbol_scales_msg(self.loads(raw)).items():
+            self.scales[symbol.upper()] = scale
 
     async def orderbook_snapshot(self, symbol):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(self.rest_url + self.rest_depth_endpoint.format(symbol)) as resp:
-                snapshot = await resp.json()
-                snapshot_timestamp = time.time()
-                snapshot_msg = {
-                    'messageType': 'orderbook_snapshot',
-                    'message': self.process_ob_snapshot(snapshot),
-                    'systemTime': snapshot_timestamp,
-                    'symbol': symbol.upper(),
-                    'exchange': self.name
-                }
-
-        return snapshot_msg
+        async with self.http_session().get(self.rest_url + self.rest_depth_endpoint.format(symbol),
+                                           timeout=self.http_timeout) as resp:
+            raw = await resp.read()
+        if self.recorder is not None:
+            self.recorder.record(BOOK_SNAPSHOT, time.time(), raw, key=symbol.upper())
+
+        return self.snapshot_envelope(raw, symbol)
+
+    def snapshot_envelope(self, raw, symbol):
+        return BookMessage('orderbook_snapshot', self.process_ob_snapshot(self.loads(raw), symbol),
+                           time.time(), symbol.upper(), self.name)
+
+    def market_shards(self):
+        """
+        Splits symbols into groups of at most streams_per_connection streams, all streams of a symbol
+        share a connection so its updates stay in order
+        """
+        if not self.streams_per_connection or self.subscribe_payloads is None:
+            return [list(self.symbols)]
+        per_connection = max(1, self.streams_per_connection // self.streams_per_symbol)
+        return [self.symbols[i:i + per_connection] for i in range(0, len(self.symbols), per_connection)]
 
     async def marketdata_ws(self, ob_queue: asyncio.Queue):
+        """
+        Runs one receive loop per market data connection, all feeding ob_queue
+        """
+        for symbol in self.symbols:
+            self.symbols_active[symbol] = False
+
+        shards = self.market_shards()
+        if len(shards) == 1:
+            await self.market_shard_ws(shards[0], ob_queue)
+            return
+        print(f'{self.name}: {len(self.symbols)} symbols on {len(shards)} market data connections')
+        async with asyncio.TaskGroup() as tg:
+            for shard_id, symbols in enumerate(shards):
+                tg.create_task(self.market_shard_ws(symbols, ob_queue, label=f'{self.name}#{shard_id}'))
+
+    async def market_shard_ws(self, symbols, ob_queue: asyncio.Queue, label=None):
 
         last_message_timestamp: float = time.time()
-        messages_queued: int = 0
         messages_accepted: int = 0
         messages_rejected: int = 0
-
-        for symbol in self.symbols:
-            self.symbols_active[symbol] = False
-
-        while not self.ws_active:
+        # trade and other non depth frames
+        messages_other: int = 0
+        label = label or self.name
+
+        if self.subscribe_payloads is not None:
+            payloads = self.subscribe_payloads(symbols)
+        else:
+            payloads = [self.trade_payload, self.depth_payload]
+
+        connected = False
+        while not connected:
+            connected = True
             self.ws_active = True
-            async with self.connection as ws:
+            connection = self.connection if self.subscribe_payloads is None else websockets.connect(uri=self.ws_url)
+            async with connection as ws:
 
-                await ws.send(json.dumps(self.trade_payload))
-                print(f'Connected to {self.name} trade data stream')
-                await ws.send(json.dumps(self.depth_payload))
-                print(f'Connected to {self.name} orderbook depth data stream')
+                for payload in payloads:
+                    await ws.send(json.dumps(payload))
+                print(f'Connected to {label} market data streams ({len(symbols)} symbols)')
                 last_ping = time.time()
 
                 while True:
                     try:
                         msg = await ws.recv()
-                        msg = json.loads(msg)
-                        # print(msg)
-
-                        if msg[self.channel_key_column] == self.channel_keys['trade']:
-                            trade_msg = []
-                            continue
-                        # OB updates
-                        if msg[self.channel_key_column] == self.channel_keys['depth'] and self.snapshot_in_ws:
-                            if msg[self.event_key_column] == self.event_keys['snapshot']:
-                                snapshot_msg = self.process_ob_snapshot(msg)
-                                await ob_queue.put({
-                                    'messageType': 'orderbook_snapshot',
-                                    'message': snapshot_msg,
-                                    'timestamp': time.time(),
-                                    'symbol': snapshot_msg['symbol'].upper(),
-                                    'exchange': self.name
-                                })
-                                self.symbols_active[snapshot_msg['symbol'].upper()] = True
-
-                        if msg[self.channel_key_column] == self.channel_keys['depth'] \
-                                and (msg[self.event_key_column] == self.event_keys['update']
-                                     or self.event_keys['update'] == 'None'):
-
-                            depth_msg = self.modify_update_msg(msg)
-
-                            # if no snapshot yet, use snapshot first
-                            if not self.symbols_active[depth_msg['symbol'].upper()]:
-                                snapshot_msg = await self.orderbook_snapshot(depth_msg['symbol'].upper())
-                                await ob_queue.put(snapshot_msg)
-                                self.symbols_active[depth_msg['symbol'].upper()] = True
-                                continue
-
-                            if self.symbols_active[depth_msg['symbol'].upper()]:
-                                await ob_queue.put({
-                                    'messageType': 'orderbook_update',
-                                    'message': depth_msg,
-                                    'timestamp': time.time(),
-                                    'symbol': depth_msg['symbol'].upper(),
-                                    'exchange': self.name
-                                })
-
-                                messages_accepted += 1
-                                # Log some statistics.
-                                now: float = time.time()
-
-                                if now - last_ping > 20 and self.ping_msg is not None:
-                                    await ws.send(json.dumps(self.ping_msg))
-                                    last_ping = time.time()
-
-                                if int(now / 60.0) > int(last_message_timestamp / 60.0):
-                                    print(f"Diff messages processed: {messages_accepted}, "
-                                          f"rejected: {messages_rejected}, queued: {messages_queued}")
-                                    messages_accepted = 0
-                                    messages_rejected = 0
-                                    messages_queued = 0
-                                last_message_timestamp = now
+                        recv_time = time.time()
+                        if self.recorder is not None:
+                            self.recorder.record(MARKET_WS, recv_time, msg)
+
+                        queued = await self.on_market_message(msg, ob_queue, recv_time)
+                        if queued:
+                            messages_accepted += 1
+                        else:
+                            messages_other += 1
+
+                        # ping and log statistics on any frame, a trade-only shard must keep its connection
+                        now: float = time.time()
+
+                        if now - last_ping > 20 and self.ping_msg is not None:
+                            await ws.send(json.dumps(self.ping_msg))
+                            last_ping = time.time()
+
+                        if int(now / 60.0) > int(last_message_timestamp / 60.0):
+                            print(f"|{label}| Diff messages processed: {messages_accepted}, "
+                                  f"rejected: {messages_rejected}, queue backlog: {ob_queue.qsize()}, "
+                                  f"other frames: {messages_other}")
+                            messages_accepted = 0
+                            messages_rejected = 0
+                            messages_other = 0
+                        last_message_timestamp = now
 
                     except KeyError:
+                        messages_rejected += 1
                         continue
                     # except asyncio.CancelledError:
                     # print(f'{self.name} Cancelled error')
                     except Exception as e:
-                        print(f'|{self.name}| Error: {e}, retrying in 1 second')
+                        print(f'|{label}| Error: {e}, retrying in 1 second')
                         await asyncio.sleep(1)
-                        self.ws_active = False
+                        connected = False
                         break
 
+    async def on_market_message(self, msg, ob_queue, recv_time=None):
+        """
+        Decodes one raw market data frame and queues the resulting book messages, trades go to trade_queue.
+        Returns True when a depth update was queued.
+        """
+        if recv_time is None:
+            recv_time = time.time()
+        msg = self.loads(msg)
+        # print(msg)
+
+        if msg[self.channel_key_column] == self.channel_keys['trade']:
+            if self.trade_queue is not None and self.modify_trade_msg is not None:
+                self.trade_queue.put_nowait(self.modify_trade_msg(msg))
+            return False
+        # OB updates
+        if msg[self.channel_key_column] == self.channel_keys['depth'] and self.snapshot_in_ws:
+            if msg[self.event_key_column] == self.event_keys['snapshot']:
+                snapshot_msg = self.process_ob_snapshot(msg)
+                await ob_queue.put(BookMessage('orderbook_snapshot', snapshot_msg, time.time(),
+                                               snapshot_msg.symbol, self.name))
+                self.symbols_active[snapshot_msg.symbol] = True
+
+        if msg[self.channel_key_column] == self.channel_keys['depth'] \
+                and (msg[self.event_key_column] == self.event_keys['update']
+                     or self.event_keys['update'] == 'None'):
+
+            depth_msg = self.modify_update_msg(msg)
+            decode_time = time.time()
+
+            # books without a snapshot buffer the update and fetch one in the background (see booksync)
+            await ob_queue.put(BookMessage('orderbook_update', depth_msg, time.time(),
+                                           depth_msg.symbol.upper(), self.name, recv_time, decode_time))
+            return True
+
+        return False
+
     async def userdata_snapshot(self, balance_queue: asyncio.Queue):
         params, headers = self.user_snapshot_params(time.time(), self.api_key, self.api_secret)
-        async with aiohttp.ClientSession() as session:
-            async with session.get(self.rest_url + self.account_snapshot_endpoint, params=params,
-                                   headers=headers) as resp:
-                msg = await resp.json()
-                account_snapshot = self.account_snapshot_msg(msg)
-
-                balances = []
-                for x in account_snapshot.get('balances'):
-                    #      asset       free balance       locked balance
-                    b = [x.get('asset'), float(x.get('free')), float(x.get('locked'))]
-                    balances.append(b)
-
-                snapshot_msg = {'msgType': 'snapshot',
-                                'eventTime': time.time(),
-                                'balances': balances
-                                }
-                await balance_queue.put(snapshot_msg)
-                self.maker_fee = float(account_snapshot.get('makerFee'))
-                self.taker_fee = float(account_snapshot.get('takerFee'))
+        async with self.http_session().get(self.rest_url + self.account_snapshot_endpoint, params=params,
+                                           headers=headers, timeout=self.http_timeout) as resp:
+            raw = await resp.read()
+        if self.recorder is not None:
+            self.recorder.record(ACCOUNT_SNAPSHOT, time.time(), raw)
+        await self.on_account_snapshot(raw, balance_queue)
+
+    async def on_account_snapshot(self, raw, balance_queue):
+        account_snapshot = self.account_snapshot_msg(self.loads(raw))
+
+        balances = []
+        for x in account_snapshot.balances:
+            #      asset       free balance       locked balance
+            b = [x.get('asset'), float(x.get('free')), float(x.get('locked'))]
+            balances.append(b)
+
+        await balance_queue.put(BalanceMessage('snapshot', time.time(), balances, self.name))
+        self.maker_fee = float(account_snapshot.makerFee)
+        self.taker_fee = float(account_snapshot.takerFee)
 
     async def on_userdata_message(self, balance_queue, order_queue):
         async for msg in self.ws_session:
             if msg.type == aiohttp.WSMsgType.text:
-
-                msg = msg.json()
-
-                if msg['e'] == "outboundAccountPosition":
-                    account_msg = self.account_update_msg(msg)
-                    account_msg2 = {'msgType': 'update',
-                                    'eventTime': time.time(),
-                                    'balances': account_msg['balances']
-                                    }
-                    await balance_queue.put(account_msg2)
-
-                if msg['e'] == "executionReport":
-                    order_msg = self.order_update_msg(msg)
-                    await order_queue.put(order_msg)
+                if self.recorder is not None:
+                    self.recorder.record(USER_WS, time.time(), msg.data)
+                await self.handle_userdata_message(msg.data, balance_queue, order_queue)
 
             elif msg.type == aiohttp.WSMsgType.closed:
                 self.user_ws_active = False
                 break
 
+    async def handle_userdata_message(self, msg, balance_queue, order_queue):
+        msg = self.loads(msg)
+
+        if msg['e'] == "outboundAccountPosition":
+            account_msg = self.account_update_msg(msg)
+            await balance_queue.put(BalanceMessage('update', time.time(), account_msg.balances, self.name))
+
+        if msg['e'] == "executionReport":
+            order_msg = self.order_update_msg(msg)
+            await order_queue.put(order_msg)
+
     async def get_listen_key(self):
         headers = {'X-MBX-APIKEY': self.api_key}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.rest_url + self.rest_userData_endpoint, headers=headers) as resp:
-                key = await resp.json()
-                self.userListenKey = key.get('listenKey')
+        async with self.http_session().post(self.rest_url + self.rest_userData_endpoint, headers=headers,
+                                            timeout=self.http_timeout) as resp:
+            key = await resp.json()
+            self.userListenKey = key.get('listenKey')
 
     async def userdata_ws(self, balance_queue: asyncio.Queue, order_queue: asyncio.Queue):
         if self.user_ws_method == 'listenkey' and self.userListenKey is not None:
             while not self.user_ws_active:
                 self.user_ws_active = True
-                async with aiohttp.ClientSession() as session:
-                    url = self.ws_url_private + self.userListenKey
-                    self.ws_session = await session.ws_connect(url)
-                    print(f'Connected to {self.name} user data stream')
+                url = self.ws_url_private + self.userListenKey
+                self.ws_session = await self.http_session().ws_connect(url)
+                print(f'Connected to {self.name} user data stream')
+                try:
                     await self.on_userdata_message(balance_queue, order_queue)
+                finally:
+                    await self.ws_session.close()
 
     async def authenticate_ws(self):
 
@@ -0,0 +1,201 @@
+from bisect import bisect_left
+import time
+from fixedpoint import SymbolScale
+from datatypes import TopOfBook
+
+# sync states, see booksync.BookSync
+BOOK_SYNCING = 'syncing'
+BOOK_LIVE = 'live'
+BOOK_STALE = 'stale'
+
+
+class BookSide:
+    """
+    One side of an L2 order book: a price -> quantity dict plus a sorted list of price keys.
+    Bid keys are stored negated so both sides keep their best level at index 0.
+    """
+    __slots__ = ('sign', 'levels', 'keys', 'max_depth')
+
+    def __init__(self, is_bid, max_depth=1000):
+        self.sign = -1 if is_bid else 1
+        self.levels = {}
+        self.keys = []
+        self.max_depth = max_depth
+
+    def __len__(self):
+        return len(self.keys)
+
+    def clear(self):
+        self.levels.clear()
+        self.keys.clear()
+
+    def update(self, price, quantity):
+        levels = self.levels
+        # quantity is 0: remove level if present
+        if quantity == 0:
+            if levels.pop(price, None) is not None:
+                keys = self.keys
+                del keys[bisect_left(keys, self.sign * price)]
+            return
+
+        # price not found: insert key in sorted position
+        if price not in levels:
+            keys = self.keys
+            key = self.sign * price
+            i = bisect_left(keys, key)
+            # side is full and the new level is worse than all resting levels
+            if i >= self.max_depth:
+                return
+            keys.insert(i, key)
+            # maintain side depth <= max_depth
+            if len(keys) > self.max_depth:
+                del levels[self.sign * keys.pop()]
+        levels[price] = quantity
+
+    def best(self):
+        if not self.keys:
+            return None
+        price = self.sign * self.keys[0]
+        return price, self.levels[price]
+
+    def top(self, n=None):
+        """
+        Returns [[price, quantity], ...] from best to worst, limited to n levels if given
+        """
+        sign = self.sign
+        levels = self.levels
+        keys = self.keys if n is None else self.keys[:n]
+        return [[sign * k, levels[sign * k]] for k in keys]
+
+
+class OrderBook:
+    """
+    Local L2 order book for one exchange|symbol pair. Levels are kept as fixed-point integers
+    (see SymbolScale); the list views convert back to float.
+    Supports the old dict-of-lists message layout through item access (book['message']['bids']).
+    """
+
+    def __init__(self, exchange, symbol, scale=None, max_depth=1000):
+        self.exchange = exchange
+        self.symbol = symbol.upper()
+        self.scale = scale if scale is not None else SymbolScale(self.symbol)
+        self.bid_side = BookSide(is_bid=True, max_depth=max_depth)
+        self.ask_side = BookSide(is_bid=False, max_depth=max_depth)
+        self.last_update_id = None
+        self.timestamp = None
+        self.message_type = None
+        self.sync_state = BOOK_SYNCING
+        # optional observer with on_snapshot() / on_diffs(bids, asks), called before diffs are applied
+        self.listener = None
+
+    def apply_snapshot(self, snapshot_msg):
+        message = snapshot_msg.message
+        self.bid_side.clear()
+        self.ask_side.clear()
+        for price, quantity in message.bids:
+            self.bid_side.update(price, quantity)
+        for price, quantity in message.asks:
+            self.ask_side.update(price, quantity)
+        self.last_update_id = message.lastUpdateId
+        self.timestamp = time.time()
+        self.message_type = 'orderbook_snapshot'
+        if self.listener is not None:
+            self.listener.on_snapshot()
+
+    def apply_diffs(self, bids, asks, last_update_id):
+        if self.listener is not None:
+            self.listener.on_diffs(bids, asks)
+        bid_update = self.bid_side.update
+        ask_update = self.ask_side.update
+        for price, quantity in bids:
+            bid_update(price, quantity)
+        for price, quantity in asks:
+            ask_update(price, quantity)
+        self.last_update_id = last_update_id
+        self.timestamp = time.time()
+        self.message_type = 'live_orderbook'
+
+    @property
+    def initialized(self):
+        return self.last_update_id is not None
+
+    @property
+    def live(self):
+        return self.sync_state == BOOK_LIVE
+
+    @property
+    def stale(self):
+        """
+        True after a sequence gap until the book is resynced, levels may be out of date
+        """
+        return self.sync_state == BOOK_STALE
+
+    def best_bid(self):
+        return self.bid_side.best()
+
+    def best_ask(self):
+        return self.ask_side.best()
+
+    def top(self):
+        """
+        ((bid price, bid qty), (ask price, ask qty)) in fixed-point, a side is None when empty.
+        Compare two calls to detect top-of-book changes.
+        """
+        return self.bid_side.best(), self.ask_side.best()
+
+    def top_of_book(self, event_time=None, top=None):
+        """
+        TopOfBook event (floats) for the current or given top()
+        """
+        bid, ask = top if top is not None else self.top()
+        price_factor = self.scale.price_factor
+        qty_factor = self.scale.qty_factor
+        return TopOfBook(self.exchange, self.symbol,
+                         event_time if event_time is not None else self.timestamp, self.timestamp,
+                         bid[0] / price_factor if bid else None, bid[1] / qty_factor if bid else None,
+                         ask[0] / price_factor if ask else None, ask[1] / qty_factor if ask else None)
+
+    def mid_price(self):
+        """
+        Mid price as float, None if either side is empty
+        """
+        if not self.bid_side.keys or not self.ask_side.keys:
+            return None
+        return (self.bid_side.best()[0] + self.ask_side.best()[0]) / (2 * self.scale.price_factor)
+
+    @property
+    def bids(self):
+        level_to_float = self.scale.level_to_float
+        return [level_to_float(level) for level in self.bid_side.top()]
+
+    @property
+    def asks(self):
+        level_to_float = self.scale.level_to_float
+        return [level_to_float(level) for level in self.ask_side.top()]
+
+    @property
+    def message(self):
+        return {'lastUpdateId': self.last_update_id,
+                'bids': self.bids,
+                'asks': self.asks
+                }
+
+    def __repr__(self):
+        # top 5 levels a side, as floats
+        level_to_float = self.scale.level_to_float
+        return (f'OrderBook({self.exchange}|{self.symbol}, {self.sync_state}, lastUpdateId={self.last_update_id}, '
+                f'bids={[level_to_float(level) for level in self.bid_side.top(5)]}, '
+                f'asks={[level_to_float(level) for level in self.ask_side.top(5)]})')
+
+    def __getitem__(self, key):
+        if key == 'messageType':
+            return self.message_type
+        if key == 'message':
+            return self.message
+        if key == 'timestamp':
+            return self.timestamp
+        if key == 'symbol':
+            return self.symbol
+        if key == 'exchange':
+            return self.exchange
+        raise KeyError(key)
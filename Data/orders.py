@@ -0,0 +1,103 @@
+from typing import Dict, Optional, Tuple
+from datatypes import ExecutionReport, Position, position_msg, fill_msg
+
+# order statuses after which an order is no longer open
+TERMINAL_STATUSES = frozenset(['FILLED', 'CANCELED', 'REJECTED', 'EXPIRED', 'EXPIRED_IN_MATCH'])
+TERMINAL_EXECUTIONS = frozenset(['CANCELED', 'REJECTED', 'EXPIRED'])
+
+
+class OrderStore:
+    """
+    Open orders keyed by client order id, with a secondary index by (exchange, symbol, side) so queries like
+    "all my bids on BTCUSD" do not scan every order. Each order is its latest ExecutionReport; every lifecycle
+    transition (new, partial fill, fill, cancel, expiry) is O(1).
+    """
+
+    def __init__(self):
+        self.orders: Dict[str, ExecutionReport] = {}
+        self.books: Dict[Tuple[str, str, str], Dict[str, ExecutionReport]] = {}
+        self.fills = 0
+        self.unmatched = 0
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __contains__(self, client_order_id):
+        return client_order_id in self.orders
+
+    def __iter__(self):
+        return iter(self.orders.values())
+
+    def get(self, client_order_id, default=None):
+        return self.orders.get(client_order_id, default)
+
+    def _add(self, msg):
+        self.orders[msg.clientOrderID] = msg
+        self.books.setdefault((msg.exchange, msg.symbol, msg.side), {})[msg.clientOrderID] = msg
+
+    def _update(self, msg):
+        self.orders[msg.clientOrderID] = msg
+        self.books[(msg.exchange, msg.symbol, msg.side)][msg.clientOrderID] = msg
+
+    def _remove(self, client_order_id):
+        order = self.orders.pop(client_order_id, None)
+        if order is None:
+            return None
+        book = self.books[(order.exchange, order.symbol, order.side)]
+        del book[client_order_id]
+        return order
+
+    def apply(self, msg) -> Optional[Position]:
+        """
+        Applies an execution report, returns the fill as a Position for TRADE events
+        """
+        execution_type = msg.executionType
+
+        if execution_type == 'NEW':
+            self._add(msg)
+            return None
+
+        if execution_type == 'TRADE':
+            # trades carry the order's own id, cancels the cancel request id and the original in origClientOrderID
+            client_order_id = msg.clientOrderID
+            if client_order_id in self.orders:
+                if msg.orderStatus in TERMINAL_STATUSES:
+                    self._remove(client_order_id)
+                else:
+                    self._update(msg)
+            elif msg.orderStatus not in TERMINAL_STATUSES:
+                # first report of an order seen mid-life (e.g. started after it was placed)
+                self._add(msg)
+            self.fills += 1
+            if msg.last_fill_quantity is not None:
+                return fill_msg(msg, msg.exchange)
+            return position_msg(msg, msg.exchange)
+
+        if execution_type in TERMINAL_EXECUTIONS:
+            client_order_id = msg.origClientOrderID or msg.clientOrderID
+            if self._remove(client_order_id) is None and execution_type != 'REJECTED':
+                self.unmatched += 1
+            return None
+
+        if execution_type == 'REPLACED' and msg.origClientOrderID:
+            self._remove(msg.origClientOrderID)
+            self._add(msg)
+        return None
+
+    def open_orders(self, exchange=None, symbol=None, side=None):
+        """
+        Open orders filtered by exchange / symbol / side, index lookup when all three are given
+        """
+        if exchange is not None and symbol is not None and side is not None:
+            return list(self.books.get((exchange, symbol.upper(), side.upper()), {}).values())
+        return [order for key, book in self.books.items()
+                if (exchange is None or key[0] == exchange)
+                and (symbol is None or key[1] == symbol.upper())
+                and (side is None or key[2] == side.upper())
+                for order in book.values()]
+
+    def bids(self, exchange, symbol):
+        return self.open_orders(exchange, symbol, 'BUY')
+
+    def asks(self, exchange, symbol):
+        return self.open_orders(exchange, symbol, 'SELL')
@@ -0,0 +1,172 @@
+import time
+from typing import Dict, Tuple
+from ringbuffer import RingBuffer
+
+NAV_COLUMNS = ['timestamp', 'nav', 'cash', 'realized', 'unrealized', 'fees']
+
+
+class Inventory:
+    """
+    Position in one exchange|symbol: signed base quantity, average cost, realized PnL and fees (quote, float)
+    """
+    __slots__ = ('exchange', 'symbol', 'quantity', 'avg_cost', 'realized', 'fees', 'mark', 'unrealized',
+                 'market_value')
+
+    def __init__(self, exchange, symbol):
+        self.exchange = exchange
+        self.symbol = symbol
+        self.quantity = 0.0
+        self.avg_cost = 0.0
+        self.realized = 0.0
+        self.fees = 0.0
+        self.mark = None
+        self.unrealized = 0.0
+        self.market_value = 0.0
+
+    def fill(self, quantity, price):
+        """
+        Applies a signed fill (buy > 0), returns realized PnL of the closed part
+        """
+        position = self.quantity
+        realized = 0.0
+        if position == 0 or (position > 0) == (quantity > 0):
+            # adding to the position
+            total = position + quantity
+            self.avg_cost = (self.avg_cost * position + price * quantity) / total
+            self.quantity = total
+            return realized
+
+        closed = min(abs(quantity), abs(position))
+        realized = (price - self.avg_cost) * closed * (1 if position > 0 else -1)
+        self.realized += realized
+        total = position + quantity
+        if total == 0 or (total > 0) != (position > 0):
+            # flat, or flipped: the remainder opens at the fill price
+            self.avg_cost = price if total != 0 else 0.0
+        self.quantity = total
+        return realized
+
+    def revalue(self):
+        if self.mark is None:
+            self.unrealized = 0.0
+            self.market_value = 0.0
+        else:
+            self.unrealized = (self.mark - self.avg_cost) * self.quantity
+            self.market_value = self.mark * self.quantity
+
+
+class PositionEngine:
+    """
+    Incremental inventory and PnL per (exchange, symbol), updated in O(1) per fill and per mark (mid) change.
+    NAV = cash + sum(quantity * mark); cash moves with fills and fees. Portfolio totals are maintained as
+    running sums, so nav() never rescans positions, and every change appends a row to the NAV ring buffer.
+    """
+
+    def __init__(self, quote='USD', history=100000):
+        self.quote = quote
+        self.inventories: Dict[Tuple[str, str], Inventory] = {}
+        self.fee_rates: Dict[str, Tuple[float, float]] = {}
+        self.cash = 0.0
+        # per exchange share of cash, so a balance snapshot replaces that account's cash
+        self.exchange_cash: Dict[str, float] = {}
+        self.realized = 0.0
+        self.unrealized = 0.0
+        self.market_value = 0.0
+        self.fees = 0.0
+        self.nav_history = RingBuffer(history, NAV_COLUMNS)
+
+    def inventory(self, exchange, symbol):
+        key = (exchange, symbol.upper())
+        inventory = self.inventories.get(key)
+        if inventory is None:
+            inventory = self.inventories[key] = Inventory(exchange, symbol.upper())
+        return inventory
+
+    def set_fees(self, exchange, maker_fee, taker_fee):
+        self.fee_rates[exchange] = (maker_fee or 0.0, taker_fee or 0.0)
+
+    def load_balances(self, exchange, balances, symbols=None):
+        """
+        Sets the exchange's cash and inventories from a balance snapshot ([asset, free, locked] rows), replacing
+        what an earlier snapshot and fills put there: a snapshot is the account's full state. Positions opened
+        by the snapshot are valued from the first mark with that mark as their cost, existing ones keep theirs.
+        """
+        cash = 0.0
+        holdings = {}
+        for asset, free, locked in balances:
+            amount = float(free) + float(locked)
+            if asset == self.quote:
+                cash += amount
+                continue
+            symbol = asset + self.quote
+            if symbols is not None and symbol not in symbols:
+                continue
+            holdings[symbol] = amount
+
+        self.cash += cash - self.exchange_cash.get(exchange, 0.0)
+        self.exchange_cash[exchange] = cash
+        for (inventory_exchange, symbol), inventory in self.inventories.items():
+            if inventory_exchange == exchange and symbol not in holdings:
+                holdings[symbol] = 0.0
+        for symbol, amount in holdings.items():
+            inventory = self.inventory(exchange, symbol)
+            if inventory.quantity == amount:
+                continue
+            if inventory.quantity == 0 or amount == 0 or (inventory.quantity > 0) != (amount > 0):
+                inventory.avg_cost = inventory.mark if inventory.mark is not None else float('nan')
+            inventory.quantity = amount
+            self._revalue(inventory)
+
+    def on_fill(self, exchange, symbol, side, quantity, price, is_maker=None, timestamp=None):
+        """
+        quantity / price as floats; fee from the exchange's maker or taker rate on the fill notional
+        """
+        inventory = self.inventory(exchange, symbol)
+        signed = quantity if side == 'BUY' else -quantity
+        notional = quantity * price
+        maker_fee, taker_fee = self.fee_rates.get(exchange, (0.0, 0.0))
+        fee = notional * (maker_fee if is_maker else taker_fee)
+
+        if inventory.avg_cost != inventory.avg_cost:
+            # seeded holding not marked yet
+            inventory.avg_cost = price
+        if inventory.mark is None:
+            inventory.mark = price
+        realized = inventory.fill(signed, price)
+        inventory.fees += fee
+        self.realized += realized
+        self.fees += fee
+        self.cash -= signed * price + fee
+        self.exchange_cash[exchange] = self.exchange_cash.get(exchange, 0.0) - (signed * price + fee)
+        self._revalue(inventory)
+        self._record(timestamp)
+        return realized
+
+    def on_mark(self, exchange, symbol, mark, timestamp=None):
+        inventory = self.inventory(exchange, symbol)
+        inventory.mark = mark
+        if inventory.avg_cost != inventory.avg_cost:
+            inventory.avg_cost = mark
+        if inventory.quantity == 0 and inventory.market_value == 0:
+            return
+        self._revalue(inventory)
+        self._record(timestamp)
+
+    def _revalue(self, inventory):
+        unrealized, market_value = inventory.unrealized, inventory.market_value
+        inventory.revalue()
+        self.unrealized += inventory.unrealized - unrealized
+        self.market_value += inventory.market_value - market_value
+
+    def _record(self, timestamp=None):
+        self.nav_history.append(time.time() if timestamp is None else timestamp, self.nav(), self.cash,
+                                self.realized, self.unrealized, self.fees)
+
+    def nav(self):
+        return self.cash + self.market_value
+
+    def summary(self):
+        return {'nav': self.nav(), 'cash': self.cash, 'realized': self.realized, 'unrealized': self.unrealized,
+                'fees': self.fees,
+                'positions': {f'{exchange}|{symbol}': inventory.quantity
+                              for (exchange, symbol), inventory in self.inventories.items() if inventory.quantity}}
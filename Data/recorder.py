@@ -0,0 +1,80 @@
+import mmap
+import os
+import struct
+import time
+
+# record kinds
+MARKET_WS = 0
+BOOK_SNAPSHOT = 1
+USER_WS = 2
+ACCOUNT_SNAPSHOT = 3
+EXCHANGE_INFO = 4
+
+# receive time, record kind, key length, payload length
+_HEADER = struct.Struct('<dBHI')
+
+
+class FeedRecorder:
+    """
+    Append-only log of raw websocket frames and REST payloads with their receive timestamps.
+    Each record is a fixed header followed by the key (e.g. snapshot symbol) and the raw payload bytes,
+    so a recording can be scanned in place with read_records.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.file = open(path, 'ab', buffering=2 ** 20)
+        self.flush_interval = flush_interval
+        self.last_flush = time.time()
+        self.records = 0
+        self.bytes = 0
+
+    def record(self, kind, recv_time, payload, key=''):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        key = key.encode()
+        self.file.write(_HEADER.pack(recv_time, kind, len(key), len(payload)))
+        if key:
+            self.file.write(key)
+        self.file.write(payload)
+        self.records += 1
+        self.bytes += _HEADER.size + len(key) + len(payload)
+
+        if recv_time - self.last_flush > self.flush_interval:
+            self.file.flush()
+            self.last_flush = recv_time
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def read_records(path, kinds=None):
+    """
+    Iterates (receive time, kind, key, payload bytes) over a recording through mmap.
+    A truncated last record (interrupted session) is skipped.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            header_size = _HEADER.size
+            unpack_from = _HEADER.unpack_from
+            offset = 0
+            while offset + header_size <= size:
+                recv_time, kind, key_len, payload_len = unpack_from(mm, offset)
+                offset += header_size
+                end = offset + key_len + payload_len
+                if end > size:
+                    break
+                if kinds is None or kind in kinds:
+                    key = mm[offset:offset + key_len].decode() if key_len else ''
+                    yield recv_time, kind, key, mm[offset + key_len:end]
+                offset = end
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-capacity columnar ring buffer backed by NumPy arrays.
+    Each row is written twice (at i and i + capacity) so the newest rows always form one contiguous slice:
+    ordered views are zero-copy and append is O(1). Views alias the buffer and are overwritten as it wraps,
+    use export() or np.copy for data that must outlive the next `capacity` appends.
+    """
+
+    def __init__(self, capacity, columns, dtype=np.float64):
+        self.capacity = capacity
+        self.columns = list(columns)
+        self._arrays = [np.zeros(2 * capacity, dtype=dtype) for _ in self.columns]
+        self._index = {name: arr for name, arr in zip(self.columns, self._arrays)}
+        self.head = 0
+        self.size = 0
+        self.total = 0
+        self.exported = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, *values):
+        i = self.head
+        j = i + self.capacity
+        for arr, value in zip(self._arrays, values):
+            arr[i] = value
+            arr[j] = value
+        i += 1
+        self.head = 0 if i == self.capacity else i
+        if self.size < self.capacity:
+            self.size += 1
+        self.total += 1
+
+    def view(self, column, n=None):
+        """
+        Ordered (oldest -> newest) zero-copy view of the last n rows of a column, all rows if n is None
+        """
+        end = self.head + self.capacity
+        size = self.size if n is None else min(n, self.size)
+        return self._index[column][end - size:end]
+
+    def __getitem__(self, column):
+        return self.view(column)
+
+    def last(self, column):
+        if not self.size:
+            raise IndexError('RingBuffer is empty')
+        return self._index[column][self.head + self.capacity - 1]
+
+    def at(self, column, index):
+        """
+        Value of the row with the given append index (0 for the first row ever appended), within the last
+        `capacity` rows
+        """
+        return self._index[column][index % self.capacity]
+
+    def views(self, n=None):
+        return {name: self.view(name, n) for name in self.columns}
+
+    def pending(self):
+        """
+        Rows appended since the last export, capped at capacity (older ones were overwritten)
+        """
+        return min(self.total - self.exported, self.capacity)
+
+    def export(self):
+        """
+        Copies out the rows appended since the last export as {column: array}, for bulk persistence
+        """
+        n = self.pending()
+        self.exported = self.total
+        return {name: self.view(name, n).copy() for name in self.columns}
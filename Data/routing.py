@@ -0,0 +1,39 @@
+import asyncio
+from typing import Dict
+
+
+class OrderBookRouter:
+    """
+    Fans order book messages out to one queue per exchange|symbol, so every book has its own consumer
+    and a slow symbol cannot hold up the others. Drop-in for the asyncio.Queue passed to marketdata_ws.
+    """
+
+    def __init__(self):
+        self.queues: Dict[str, asyncio.Queue] = {}
+
+    def queue(self, exchange_name, symbol):
+        ob_id = exchange_name + '|' + symbol.upper()
+        queue = self.queues.get(ob_id)
+        if queue is None:
+            queue = self.queues[ob_id] = asyncio.Queue()
+        return queue
+
+    def put_nowait(self, msg):
+        ob_id = msg.exchange + '|' + msg.symbol
+        queue = self.queues.get(ob_id)
+        if queue is None:
+            queue = self.queue(msg.exchange, msg.symbol)
+        queue.put_nowait(msg)
+
+    async def put(self, msg):
+        # per-book queues are unbounded, routing never waits
+        self.put_nowait(msg)
+
+    def qsize(self):
+        return sum(queue.qsize() for queue in self.queues.values())
+
+    def backlog(self):
+        """
+        Queue depth per exchange|symbol
+        """
+        return {ob_id: queue.qsize() for ob_id, queue in self.queues.items()}
@@ -0,0 +1,181 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from datatypes import BookLevels
+from orderbook import BOOK_SYNCING, BOOK_LIVE, BOOK_STALE
+
+# per book header (int64 words), followed by depth bid rows and depth ask rows of [price, quantity]
+_SEQ = 0
+_LAST_UPDATE_ID = 1
+_TIMESTAMP_NS = 2
+_BID_COUNT = 3
+_ASK_COUNT = 4
+_PRICE_DECIMALS = 5
+_QTY_DECIMALS = 6
+_STATE = 7
+_HEADER_WORDS = 8
+
+_STATES = [BOOK_SYNCING, BOOK_LIVE, BOOK_STALE]
+_STATE_CODES = {state: i for i, state in enumerate(_STATES)}
+
+
+class SharedBookSegment:
+    """
+    Top-N fixed-point books for a set of symbols in one multiprocessing.shared_memory block, written by a
+    single feed process and read by any number of processes without locks or IPC.
+    Every book slot is guarded by a seqlock: the writer makes the sequence odd, writes, then makes it even
+    again; a reader retries while the sequence is odd or changed during its read. Relies on x86-64 ordering:
+    aligned int64 stores are not torn and stores / loads are not reordered with each other.
+    """
+
+    def __init__(self, exchange, symbols, depth=20, name=None, create=True):
+        self.exchange = exchange
+        self.symbols = [symbol.upper() for symbol in symbols]
+        self.depth = depth
+        self.slot_words = _HEADER_WORDS + 4 * depth
+        size = len(self.symbols) * self.slot_words * 8
+        self.created = create
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            # child processes share the parent's resource tracker, the creating process unlinks the segment
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+        words = np.ndarray((len(self.symbols), self.slot_words), dtype=np.int64, buffer=self.shm.buf)
+        if create:
+            words[:] = 0
+        self._words = words
+        self.slots = {}
+        for i, symbol in enumerate(self.symbols):
+            slot = words[i]
+            self.slots[symbol] = (slot[:_HEADER_WORDS],
+                                  slot[_HEADER_WORDS:_HEADER_WORDS + 2 * depth].reshape(depth, 2),
+                                  slot[_HEADER_WORDS + 2 * depth:].reshape(depth, 2))
+        # reader side scratch buffers, reused across reads
+        self._bids = np.empty((depth, 2), dtype=np.int64)
+        self._asks = np.empty((depth, 2), dtype=np.int64)
+
+    @classmethod
+    def attach(cls, exchange, symbols, depth, name):
+        return cls(exchange, symbols, depth, name=name, create=False)
+
+    def publish(self, orderbook):
+        """
+        Writes the book's top depth levels (writer process only)
+        """
+        header, bids, asks = self.slots[orderbook.symbol]
+        depth = self.depth
+        bid_levels = orderbook.bid_side.top(depth)
+        ask_levels = orderbook.ask_side.top(depth)
+
+        header[_SEQ] += 1
+        if bid_levels:
+            bids[:len(bid_levels)] = bid_levels
+        if ask_levels:
+            asks[:len(ask_levels)] = ask_levels
+        header[_BID_COUNT] = len(bid_levels)
+        header[_ASK_COUNT] = len(ask_levels)
+        header[_LAST_UPDATE_ID] = orderbook.last_update_id or 0
+        header[_TIMESTAMP_NS] = int((orderbook.timestamp or 0) * 1e9)
+        header[_PRICE_DECIMALS] = orderbook.scale.price_decimals
+        header[_QTY_DECIMALS] = orderbook.scale.qty_decimals
+        header[_STATE] = _STATE_CODES[orderbook.sync_state]
+        header[_SEQ] += 1
+
+    def read(self, symbol, n=None, retries=1000):
+        """
+        Consistent BookLevels (float [price, quantity] rows, best first) for the top n levels of symbol
+        """
+        header, bids, asks = self.slots[symbol.upper()]
+        n = self.depth if n is None else min(n, self.depth)
+        scratch_bids = self._bids[:n]
+        scratch_asks = self._asks[:n]
+        for _ in range(retries):
+            seq = int(header[_SEQ])
+            if seq & 1:
+                continue
+            meta = header.copy()
+            np.copyto(scratch_bids, bids[:n])
+            np.copyto(scratch_asks, asks[:n])
+            if int(header[_SEQ]) == seq:
+                break
+        else:
+            raise TimeoutError(f'{self.exchange}|{symbol} shared book is being written continuously')
+
+        price_factor = 10 ** int(meta[_PRICE_DECIMALS])
+        qty_factor = 10 ** int(meta[_QTY_DECIMALS])
+        bid_rows = scratch_bids[:min(n, int(meta[_BID_COUNT]))] / (price_factor, qty_factor)
+        ask_rows = scratch_asks[:min(n, int(meta[_ASK_COUNT]))] / (price_factor, qty_factor)
+        return BookLevels(self.exchange, symbol.upper(), _STATES[int(meta[_STATE])], int(meta[_LAST_UPDATE_ID]),
+                          int(meta[_TIMESTAMP_NS]) / 1e9, bid_rows, ask_rows)
+
+    def version(self, symbol):
+        """
+        Sequence number of the book, changes on every publish
+        """
+        return int(self.slots[symbol.upper()][0][_SEQ]) >> 1
+
+    def close(self):
+        self.slots.clear()
+        self._words = None
+        self.shm.close()
+        if self.created:
+            self.shm.unlink()
+
+
+def _feed_process_main(exchange_factory, symbols, depth, segment_name):
+    import asyncio
+    from datafeed import MasterDatafeed
+
+    exchange = exchange_factory(symbols)
+    segment = SharedBookSegment.attach(exchange.name, symbols, depth, segment_name)
+    master = MasterDatafeed(exchange_list=[exchange], symbols=symbols, shared_books=segment)
+
+    async def run():
+        try:
+            await master.market_datafeed()
+        finally:
+            await master.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        segment.close()
+
+
+class FeedProcess:
+    """
+    Runs an exchange's market data handler (websockets, decoding, book sync) in a child process that
+    publishes its books into a SharedBookSegment owned by this (parent) process.
+    name is the exchange's name, exchange_factory(symbols) builds its ExchangeDataSource inside the child,
+    e.g. exchanges.binance_us.
+    Only the books cross the process boundary: book, top of book, analytics, consolidated, trade and bar
+    events stay in the child; the parent reads books with SharedBookSegment.read.
+    """
+
+    def __init__(self, name, exchange_factory, symbols, depth=20):
+        self.exchange_factory = exchange_factory
+        self.symbols = [symbol.upper() for symbol in symbols]
+        self.depth = depth
+        self.name = name
+        self.segment = SharedBookSegment(self.name, self.symbols, depth)
+        self.process = None
+
+    def start(self):
+        self.process = mp.Process(target=_feed_process_main, name=f'feed-{self.name}', daemon=True,
+                                  args=(self.exchange_factory, self.symbols, self.depth, self.segment.name))
+        self.process.start()
+        return self
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def stop(self, timeout=5):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join(timeout)
+            self.process = None
+        self.segment.close()
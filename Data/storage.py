@@ -0,0 +1,172 @@
+import glob
+import os
+import queue
+import threading
+import time
+import fastparquet as fp
+import pandas as pd
+
+_STOP = object()
+
+
+def read_stream(output_dir, stream, columns=None):
+    """
+    Reads every Parquet file a ParquetWriter wrote for a stream into one DataFrame, in file order
+    """
+    paths = sorted(glob.glob(os.path.join(output_dir, stream, '*.parquet')), key=os.path.getmtime)
+    frames = [fp.ParquetFile(path).to_pandas(columns=columns) for path in paths]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+class _OutputFile:
+    __slots__ = ('path', 'opened', 'rows')
+
+    def __init__(self, path):
+        self.path = path
+        self.opened = time.time()
+        self.rows = 0
+
+
+class ParquetWriter:
+    """
+    Persists columnar batches ({column: array}) to Parquet from a background thread so the event loop
+    never blocks on disk. Batches are grouped by stream name (e.g. 'BBA/BinanceUS/BTCUSD') into
+    output_dir/<stream>/<timestamp>-<n>.parquet; each batch is appended as a row group and files are
+    rotated by size or age.
+    """
+
+    def __init__(self, output_dir, compression='SNAPPY', max_file_bytes=256 * 2 ** 20, max_file_seconds=3600,
+                 max_backlog=10000, log_interval=60):
+        self.output_dir = output_dir
+        self.compression = compression
+        self.max_file_bytes = max_file_bytes
+        self.max_file_seconds = max_file_seconds
+        self.log_interval = log_interval
+        self.queue = queue.Queue(maxsize=max_backlog)
+        self.thread = None
+        self.closed = False
+        self._files = {}
+        self._file_seq = 0
+
+        self.batches_written = 0
+        self.rows_written = 0
+        self.files_written = 0
+        self.batches_dropped = 0
+        self.write_errors = 0
+        self.last_write_latency = 0.0
+        self.max_write_latency = 0.0
+        self.total_write_time = 0.0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='parquet-writer', daemon=True)
+            self.thread.start()
+        return self
+
+    def write(self, stream, batch):
+        """
+        Queues a batch for writing, never blocks: when the backlog is full or the writer is closed the batch is
+        dropped and counted
+        """
+        if self.closed:
+            self.batches_dropped += 1
+            return
+        try:
+            self.queue.put_nowait((stream, batch))
+        except queue.Full:
+            self.batches_dropped += 1
+
+    def backlog(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return {'backlog': self.backlog(),
+                'batches_written': self.batches_written,
+                'rows_written': self.rows_written,
+                'files_written': self.files_written,
+                'batches_dropped': self.batches_dropped,
+                'write_errors': self.write_errors,
+                'last_write_latency': self.last_write_latency,
+                'max_write_latency': self.max_write_latency,
+                'avg_write_latency': self.total_write_time / self.batches_written if self.batches_written else 0.0
+                }
+
+    def close(self, timeout=None):
+        """
+        Flushes the backlog and stops the writer thread; batches queued without a started thread are written
+        here. Later writes are dropped
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.thread is not None:
+            self.queue.put(_STOP)
+            self.thread.join(timeout)
+            self.thread = None
+            return
+        while True:
+            try:
+                stream, batch = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self._write_item(stream, batch)
+
+    def _write_item(self, stream, batch):
+        try:
+            self._write_batch(stream, batch)
+        except Exception as e:
+            self.write_errors += 1
+            print(f'|ParquetWriter| {stream} write error: {e}')
+
+    def _run(self):
+        last_log = time.time()
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            self._write_item(*item)
+
+            now = time.time()
+            if self.log_interval and now - last_log > self.log_interval:
+                stats = self.stats()
+                print(f"Parquet batches written: {stats['batches_written']}, backlog: {stats['backlog']}, "
+                      f"dropped: {stats['batches_dropped']}, "
+                      f"avg write: {stats['avg_write_latency'] * 1000:.1f}ms, "
+                      f"max write: {stats['max_write_latency'] * 1000:.1f}ms")
+                last_log = now
+
+    def _output_file(self, stream):
+        output = self._files.get(stream)
+        if output is not None:
+            too_old = time.time() - output.opened > self.max_file_seconds
+            too_big = os.path.getsize(output.path) > self.max_file_bytes
+            if not (too_old or too_big):
+                return output
+
+        directory = os.path.join(self.output_dir, stream)
+        os.makedirs(directory, exist_ok=True)
+        self._file_seq += 1
+        name = time.strftime('%Y%m%d-%H%M%S') + f'-{self._file_seq}.parquet'
+        output = self._files[stream] = _OutputFile(os.path.join(directory, name))
+        self.files_written += 1
+        return output
+
+    def _write_batch(self, stream, batch):
+        df = pd.DataFrame(batch)
+        if df.empty:
+            return
+        start = time.perf_counter()
+        output = self._output_file(stream)
+        # first batch creates the file, later ones are appended as new row groups
+        fp.write(output.path, df, compression=self.compression, append=output.rows > 0)
+        latency = time.perf_counter() - start
+
+        output.rows += len(df)
+        self.batches_written += 1
+        self.rows_written += len(df)
+        self.last_write_latency = latency
+        self.total_write_time += latency
+        if latency > self.max_write_latency:
+            self.max_write_latency = latency
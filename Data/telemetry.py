@@ -0,0 +1,157 @@
+import time
+from typing import Dict
+
+# log-linear buckets: values below 2 * SUB are exact, above that 16 sub-buckets per power of two (~6% error)
+_SUB_BITS = 4
+_SUB = 1 << _SUB_BITS
+_LINEAR = 2 * _SUB
+_BUCKETS = _LINEAR + _SUB * 48
+
+STAGES = ['exchange_to_recv', 'recv_to_decode', 'decode_to_put', 'put_to_get', 'get_to_apply', 'recv_to_apply',
+          'end_to_end']
+
+
+def _bucket_index(value):
+    if value < _LINEAR:
+        return value
+    shift = value.bit_length() - _SUB_BITS - 1
+    return _LINEAR + (shift - 1) * _SUB + ((value >> shift) - _SUB)
+
+
+def _bucket_value(index):
+    if index < _LINEAR:
+        return index
+    shift = (index - _LINEAR) // _SUB + 1
+    mantissa = (index - _LINEAR) % _SUB + _SUB
+    # middle of the bucket
+    return (mantissa << shift) + (1 << (shift - 1))
+
+
+class LatencyHistogram:
+    """
+    Fixed-size log-linear histogram of integer latencies in microseconds (HdrHistogram-style).
+    record() is O(1) with no allocation; percentiles are accurate to ~6%.
+    """
+    __slots__ = ('counts', 'count', 'total', 'max', 'negative')
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.negative = 0
+
+    def record(self, value):
+        if value < 0:
+            # clock skew between exchange and local time
+            self.negative += 1
+            value = 0
+        value = int(value)
+        index = _bucket_index(value)
+        if index >= _BUCKETS:
+            index = _BUCKETS - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        target = p / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(_bucket_value(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def reset(self):
+        counts = self.counts
+        for i in range(_BUCKETS):
+            counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.negative = 0
+
+
+class PipelineStats:
+    """
+    Per exchange|symbol stage latencies, throughput and queue depth for the book pipeline
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self.updates = 0
+        self.snapshots = 0
+        self.max_queue_depth = 0
+        self.interval_start = time.time()
+
+    def record_update(self, msg, get_time, apply_time, queue_depth=0):
+        """
+        msg is an orderbook_update BookMessage: eventTime (ms, exchange clock), recvTime, decodeTime and
+        timestamp (queue put) in seconds
+        """
+        h = self.histograms
+        recv_time = msg.recvTime or msg.timestamp
+        decode_time = msg.decodeTime or msg.timestamp
+        event_time = msg.message.eventTime
+        if event_time:
+            h['exchange_to_recv'].record((recv_time - event_time / 1000) * 1e6)
+            h['end_to_end'].record((apply_time - event_time / 1000) * 1e6)
+        h['recv_to_decode'].record((decode_time - recv_time) * 1e6)
+        h['decode_to_put'].record((msg.timestamp - decode_time) * 1e6)
+        h['put_to_get'].record((get_time - msg.timestamp) * 1e6)
+        h['get_to_apply'].record((apply_time - get_time) * 1e6)
+        h['recv_to_apply'].record((apply_time - recv_time) * 1e6)
+        self.updates += 1
+        if queue_depth > self.max_queue_depth:
+            self.max_queue_depth = queue_depth
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+        self.updates = 0
+        self.snapshots = 0
+        self.max_queue_depth = 0
+        self.interval_start = time.time()
+
+
+class LatencyMonitor:
+    """
+    Collects PipelineStats per exchange|symbol and formats periodic percentile reports
+    """
+
+    def __init__(self):
+        self.pipelines: Dict[str, PipelineStats] = {}
+
+    def pipeline(self, key):
+        stats = self.pipelines.get(key)
+        if stats is None:
+            stats = self.pipelines[key] = PipelineStats(key)
+        return stats
+
+    def report(self, reset=True):
+        now = time.time()
+        lines = [f'{"book":<20}{"stage":<18}{"count":>9}{"p50 us":>10}{"p99 us":>10}{"p99.9 us":>10}'
+                 f'{"max us":>10}']
+        for key, stats in self.pipelines.items():
+            elapsed = now - stats.interval_start
+            rate = stats.updates / elapsed if elapsed > 0 else 0.0
+            lines.append(f'{key:<20}{stats.updates} updates ({rate:,.1f}/s), {stats.snapshots} snapshots, '
+                         f'max queue depth {stats.max_queue_depth}')
+            for stage, h in stats.histograms.items():
+                if not h.count:
+                    continue
+                skew = f'  ({h.negative} negative)' if h.negative else ''
+                lines.append(f'{"":<20}{stage:<18}{h.count:>9}{h.percentile(50):>10}{h.percentile(99):>10}'
+                             f'{h.percentile(99.9):>10}{h.max:>10}{skew}')
+            if reset:
+                stats.reset()
+        return '\n'.join(lines)
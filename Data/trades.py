@@ -0,0 +1,129 @@
+import numpy as np
+from ringbuffer import RingBuffer
+from datatypes import TradeStats
+
+# tape rows, fixed-point ints: exchange trade time (ms), trade id, price ticks, quantity lots, aggressor side
+TRADE_COLUMNS = ['tradeTime', 'tradeId', 'price', 'quantity', 'side']
+
+
+class TradeWindow:
+    """
+    Running sums over the trades of the last `seconds`, exact in fixed-point: tail is the append index of
+    the oldest trade still inside the window
+    """
+    __slots__ = ('seconds', 'span', 'tail', 'count', 'volume', 'buy_volume', 'notional')
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.span = int(seconds * 1000)
+        self.tail = 0
+        self.count = 0
+        self.volume = 0
+        self.buy_volume = 0
+        self.notional = 0
+
+    def add(self, price, quantity, side):
+        self.count += 1
+        self.volume += quantity
+        self.notional += price * quantity
+        if side > 0:
+            self.buy_volume += quantity
+
+    def remove(self, price, quantity, side):
+        self.count -= 1
+        self.volume -= quantity
+        self.notional -= price * quantity
+        if side > 0:
+            self.buy_volume -= quantity
+
+
+class TradeTape:
+    """
+    Public trades of one exchange|symbol in a columnar ring buffer, with rolling count, volume, VWAP and
+    taker buy / sell (trade flow) imbalance over each of `windows` (seconds). Every trade is added to each
+    window once and removed once as it ages out, so updates are O(windows) amortized. Windows are also
+    bounded by the buffer: a trade overwritten by the ring is dropped from the sums first.
+    """
+
+    def __init__(self, exchange, symbol, scale, windows=(1, 10, 60), capacity=100000):
+        self.exchange = exchange
+        self.symbol = symbol.upper()
+        self.scale = scale
+        self.tape = RingBuffer(capacity, TRADE_COLUMNS, dtype=np.int64)
+        self.windows = [TradeWindow(seconds) for seconds in sorted(windows)]
+        self.last_time = None
+
+    def __len__(self):
+        return len(self.tape)
+
+    def on_trade(self, trade):
+        """
+        Appends a TradeUpdate (fixed-point) and rolls the windows forward to its trade time
+        """
+        tape = self.tape
+        price = trade.price
+        quantity = trade.quantity
+        # buyer is maker: the seller was the aggressor
+        side = -1 if trade.buyerIsMaker else 1
+        trade_time = trade.tradeTime if trade.tradeTime is not None else trade.eventTime
+
+        if tape.total >= tape.capacity:
+            # the append below overwrites this row
+            overwritten = tape.total - tape.capacity
+            for window in self.windows:
+                if window.tail == overwritten:
+                    self._evict(window)
+        tape.append(trade_time, trade.tradeId, price, quantity, side)
+        for window in self.windows:
+            window.add(price, quantity, side)
+        self.last_time = trade_time
+        self.expire(trade_time)
+
+    def _evict(self, window):
+        tape = self.tape
+        index = window.tail
+        window.remove(int(tape.at('price', index)), int(tape.at('quantity', index)), int(tape.at('side', index)))
+        window.tail = index + 1
+
+    def expire(self, now_ms):
+        """
+        Drops trades older than each window at now_ms (exchange time, ms)
+        """
+        tape = self.tape
+        total = tape.total
+        for window in self.windows:
+            cutoff = now_ms - window.span
+            while window.tail < total and tape.at('tradeTime', window.tail) <= cutoff:
+                self._evict(window)
+
+    def stats(self, now=None):
+        """
+        {window seconds: TradeStats}, aged to now (seconds, exchange clock) if given, else the last trade
+        """
+        if now is not None:
+            self.expire(int(now * 1000))
+        event_time = (now * 1000 if now is not None else self.last_time or 0) / 1000
+        price_factor = self.scale.price_factor
+        qty_factor = self.scale.qty_factor
+        result = {}
+        for window in self.windows:
+            volume = window.volume
+            buy_volume = window.buy_volume
+            sell_volume = volume - buy_volume
+            result[window.seconds] = TradeStats(
+                self.exchange, self.symbol, event_time, window.seconds, window.count, volume / qty_factor,
+                buy_volume / qty_factor, sell_volume / qty_factor,
+                window.notional / volume / price_factor if volume else None,
+                (buy_volume - sell_volume) / volume if volume else 0.0)
+        return result
+
+    def export(self):
+        """
+        Trades appended since the last export as float {column: array} (time in seconds), for storage
+        """
+        rows = self.tape.export()
+        return {'timestamp': rows['tradeTime'] / 1000,
+                'trade_id': rows['tradeId'],
+                'price': rows['price'] / self.scale.price_factor,
+                'quantity': rows['quantity'] / self.scale.qty_factor,
+                'side': rows['side']}